@@ -0,0 +1,59 @@
+"""Micro-benchmark for FixedSizeCache.
+
+Run with `make bench`, or `PYTHONPATH=src python bench/cache.py` without the
+package installed.
+"""
+
+import random
+import time
+import typing
+
+from farmrpg_etl.utils.cache import FixedSizeCache
+
+
+class BaselineCache(dict):
+    """The original insertion ordered cache, for comparison."""
+
+    def __init__(self, max_size: int):
+        super().__init__()
+        self.max_size = max_size
+
+    def __setitem__(self, key, value) -> None:
+        super().__setitem__(key, value)
+        if len(self) > self.max_size:
+            del self[next(iter(self.keys()))]
+
+
+def bench(cache: typing.MutableMapping[int, int], keys: list[int]) -> float:
+    start = time.perf_counter()
+    for key in keys:
+        if cache.get(key) is None:
+            cache[key] = key
+    return time.perf_counter() - start
+
+
+def main() -> None:
+    size, n = 10_000, 1_000_000
+    rng = random.Random(0)
+    # Skewed towards a hot set, like usernames in chat.
+    keys = [int(rng.paretovariate(1.2) * 100) for _ in range(n)]
+    caches: dict[str, typing.Callable[[], typing.MutableMapping[int, int]]] = {
+        "baseline": lambda: BaselineCache(size),
+        "fifo": lambda: FixedSizeCache(size),
+        "fifo+stats": lambda: FixedSizeCache(size, name="bench"),
+        "lru": lambda: FixedSizeCache(size, policy="lru"),
+        "lru+ttl": lambda: FixedSizeCache(size, policy="lru", ttl=60),
+    }
+    for name, factory in caches.items():
+        cache = factory()
+        elapsed = bench(cache, keys)
+        # Only named caches count hits.
+        hits = getattr(cache, "hits", 0)
+        hit_rate = f", {hits / n:.1%} hits" if hits else ""
+        print(
+            f"{name:>10}: {n} lookups in {elapsed:.3f}s, {n / elapsed:,.0f}/s{hit_rate}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,39 @@
+"""Micro-benchmark for EventHub.emit throughput.
+
+Run with `make bench`, or `PYTHONPATH=src python bench/events.py` without the
+package installed.
+"""
+
+import asyncio
+import time
+
+from farmrpg_etl.events import EventHub
+
+ROOMS = ["global", "trade", "giveaways", "help", "spoilers", "staff"]
+
+
+async def noop(**kwargs) -> None:
+    pass
+
+
+async def bench(n: int) -> float:
+    hub = EventHub()
+    # Roughly what the real app registers.
+    for key in ["chat", "chat", "chat", "flags", "flags", "dm"]:
+        hub.on(key, noop, maxsize=n)
+    start = time.perf_counter()
+    for i in range(n):
+        await hub.emit(f"chat.{ROOMS[i % len(ROOMS)]}", msg=i)
+    elapsed = time.perf_counter() - start
+    await hub.drain()
+    return elapsed
+
+
+def main() -> None:
+    n = 100_000
+    elapsed = asyncio.run(bench(n))
+    print(f"{n} emits in {elapsed:.3f}s, {n / elapsed:,.0f}/s")
+
+
+if __name__ == "__main__":
+    main()
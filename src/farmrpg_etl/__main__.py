@@ -14,19 +14,35 @@ from starlette.middleware import Middleware
 from starlette.middleware.cors import CORSMiddleware
 
 from .api import routes
+from .checkpoint import CHECKPOINT
 from .db import database
+from .db.chat import load_recent_messages, message_ids
 from .events import EVENTS
 from .models.chat import Message
 from .models.user import UserSnapshot
 from .scrapers.chat import ChatScraper
 from .scrapers.mailbox import MailboxScraper
 from .scrapers.user import OnlineScraper, StaffListScraper
-from .tasks import create_periodic_task
+from .tasks import AdaptiveInterval, create_lag_monitor, create_periodic_task
+from .utils import executor
+from .utils.batch import BatchWriter
 
 UTC = ZoneInfo("UTC")
 
 START_TIME = datetime.now(tz=UTC)
 
+# Bounds for the adaptive chat and flags polling intervals, in seconds.
+CHAT_MIN_INTERVAL = float(os.environ.get("CHAT_MIN_INTERVAL", "1"))
+CHAT_MAX_INTERVAL = float(os.environ.get("CHAT_MAX_INTERVAL", "10"))
+FLAGS_MIN_INTERVAL = float(os.environ.get("FLAGS_MIN_INTERVAL", "30"))
+FLAGS_MAX_INTERVAL = float(os.environ.get("FLAGS_MAX_INTERVAL", "120"))
+# Longest a single chat, flags or mailbox scrape may take before it's cancelled.
+SCRAPE_TIMEOUT = float(os.environ.get("SCRAPE_TIMEOUT", "60"))
+# Messages per room to load from the database at startup if there's no checkpoint.
+CHAT_WARM_MESSAGES = int(os.environ.get("CHAT_WARM_MESSAGES", "110"))
+# How often to save scraper state, if STATE_PATH is set.
+CHECKPOINT_INTERVAL = float(os.environ.get("CHECKPOINT_INTERVAL", "60"))
+
 log = structlog.stdlib.get_logger(mod="main")
 
 # Imports just to register data sinks.
@@ -52,34 +68,74 @@ if False:
 
 async def start_etl():
     log.info("Starting ETL processing")
-    create_periodic_task(MailboxScraper().run, 10, name="mailbox-scraper")
-    create_periodic_task(OnlineScraper().run, 600, name="online-scraper")
-    create_periodic_task(StaffListScraper().run, 3600, name="staff-list-scraper")
     channels = ["help", "global", "spoilers", "trade", "giveaways", "trivia", "staff"]
     # channels = ["global", "help"]
+    mailbox_scraper = MailboxScraper()
+    mailbox_scraper.register_checkpoint(CHECKPOINT)
+    chat_scrapers = {channel: ChatScraper(channel) for channel in channels}
+    flags_scrapers = {
+        channel: ChatScraper(channel, flags=True, resolve_ids=message_ids.resolve)
+        for channel in channels
+    }
+    for scraper in [*chat_scrapers.values(), *flags_scrapers.values()]:
+        scraper.register_checkpoint(CHECKPOINT)
+    if not CHECKPOINT.load():
+        # Fall back to the database so we don't replay everything on the page.
+        msgs = await load_recent_messages(channels, CHAT_WARM_MESSAGES)
+        for scraper in chat_scrapers.values():
+            scraper.prime(msgs)
+        log.info("Loaded recent messages", count=len(msgs))
+    create_periodic_task(CHECKPOINT.save, CHECKPOINT_INTERVAL, name="checkpoint")
+
+    create_periodic_task(
+        mailbox_scraper.run, 10, name="mailbox-scraper", timeout=SCRAPE_TIMEOUT
+    )
+    create_periodic_task(OnlineScraper().run, 600, name="online-scraper")
+    create_periodic_task(StaffListScraper().run, 3600, name="staff-list-scraper")
     for channel in channels:
         create_periodic_task(
-            ChatScraper(channel).run, 1, name=f"chat-scraper-{channel}"
+            chat_scrapers[channel].run,
+            AdaptiveInterval(CHAT_MIN_INTERVAL, CHAT_MAX_INTERVAL),
+            name=f"chat-scraper-{channel}",
+            fixed_rate=True,
+            overrun="coalesce",
+            timeout=SCRAPE_TIMEOUT,
         )
-    # Wait for all chat loading to settle so the current message mappings are in place.
-    await asyncio.sleep(30)
     for channel in channels:
         create_periodic_task(
-            ChatScraper(channel, flags=True).run, 30, name=f"flags-scraper-{channel}"
+            flags_scrapers[channel].run,
+            AdaptiveInterval(FLAGS_MIN_INTERVAL, FLAGS_MAX_INTERVAL),
+            name=f"flags-scraper-{channel}",
+            fixed_rate=True,
+            overrun="coalesce",
+            timeout=SCRAPE_TIMEOUT,
         )
     log.info("ETL processing started")
 
 
 async def on_startup():
     await database.connect()
-    EVENTS.emit("startup")
+    await EVENTS.emit("startup")
+    create_lag_monitor()
     asyncio.create_task(start_etl(), name="start_etl")
 
 
+async def on_shutdown():
+    # Make sure anything buffered makes it to the database.
+    await EVENTS.drain()
+    await BatchWriter.flush_all()
+    # Writers can emit events of their own once they've written.
+    await EVENTS.drain()
+    await CHECKPOINT.save()
+    await database.disconnect()
+    executor.shutdown()
+
+
 app = Starlette(
     debug=True,
     routes=routes,
     on_startup=[on_startup],
+    on_shutdown=[on_shutdown],
     middleware=[
         Middleware(
             CORSMiddleware,
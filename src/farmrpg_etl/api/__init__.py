@@ -2,6 +2,8 @@ from starlette.requests import Request
 from starlette.responses import JSONResponse, Response
 from starlette.routing import Route
 
+from ..metrics import METRICS
+
 # from .auth import login
 
 
@@ -15,5 +17,9 @@ async def not_found(request: Request) -> Response:
     return Response("", status_code=404)
 
 
+async def metrics(request: Request) -> Response:
+    return Response(METRICS.render(), media_type="text/plain; version=0.0.4")
+
+
 # routes = [Route("/login", login, methods=["POST"]), Route("/{p:path}", hello_world)]
-routes = [Route("/", not_found)]
+routes = [Route("/", not_found), Route("/metrics", metrics)]
@@ -3,7 +3,7 @@ import re
 import attrs
 
 from ..events import EVENTS
-from ..http import bot_client
+from ..http import Lane, bot_client, lane
 from ..models.mailbox import Mail
 from ..scrapers.user import UserScraper
 
@@ -21,19 +21,20 @@ class BotMessage:
         return snap.user.id
 
     async def reply(self, content: str, subject: str | None = None):
-        return await bot_client.post(
-            "worker.php",
-            params={"go": "sendmessage"},
-            data={
-                "in_reply_to": self.msg.id,
-                "to": self.msg.username,
-                "subject": subject or f"RE: {self.msg.subject}",
-                "body": content,
-            },
-        )
+        with lane(Lane.MAILBOX):
+            return await bot_client.post(
+                "worker.php",
+                params={"go": "sendmessage"},
+                data={
+                    "in_reply_to": self.msg.id,
+                    "to": self.msg.username,
+                    "subject": subject or f"RE: {self.msg.subject}",
+                    "body": content,
+                },
+            )
 
 
-def try_dispatch(msg: Mail, line: str) -> tuple[bool, BotMessage]:
+async def try_dispatch(msg: Mail, line: str) -> tuple[bool, BotMessage]:
     parts = line.split(None, 1)
     if len(parts) > 1:
         cmd, args = parts
@@ -47,7 +48,7 @@ def try_dispatch(msg: Mail, line: str) -> tuple[bool, BotMessage]:
     bot_msg = BotMessage(msg=msg, cmd=cmd, args=args)
     if not cmd.strip():
         return False, bot_msg
-    return EVENTS.emit(f"bot_dm.{cmd}", msg=bot_msg), bot_msg
+    return await EVENTS.emit(f"bot_dm.{cmd}", msg=bot_msg), bot_msg
 
 
 @EVENTS.on("dm")
@@ -55,10 +56,10 @@ async def on_dm(msg: Mail):
     # First parse the first line of the message looking for a command.
     lines = BR_RE.sub("\n", msg.content).splitlines()
     line = lines[0] if lines else ""
-    handled, bot_msg = try_dispatch(msg, line)
+    handled, bot_msg = await try_dispatch(msg, line)
     if not handled:
         # Try again with the subject line.
-        handled, _ = try_dispatch(msg, msg.subject)
+        handled, _ = await try_dispatch(msg, msg.subject)
     if not handled:
         # Still nope, let them know.
         await bot_msg.reply(
@@ -0,0 +1,66 @@
+import os
+import pickle
+import tempfile
+from pathlib import Path
+from typing import Any, Callable
+
+import structlog
+
+log = structlog.stdlib.get_logger(mod="checkpoint")
+
+
+class Checkpoint:
+    """Save in-memory scraper state to disk so a restart can pick up where it left off.
+
+    Each piece of state is registered with a function to dump it to something
+    picklable and another to load it back. Nothing is saved if path is None.
+    """
+
+    def __init__(self, path: str | None) -> None:
+        self.path = Path(path) if path else None
+        self.handlers: dict[str, tuple[Callable[[], Any], Callable[[Any], None]]] = {}
+        self.loaded = False
+
+    def register(
+        self, name: str, dump: Callable[[], Any], load: Callable[[Any], None]
+    ) -> None:
+        self.handlers[name] = (dump, load)
+
+    async def save(self) -> None:
+        if self.path is None:
+            return
+        state = {name: dump() for name, (dump, _) in self.handlers.items()}
+        # Write to a temp file and rename so a crash never leaves a partial file.
+        fd, tmp = tempfile.mkstemp(dir=self.path.parent, prefix=self.path.name)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, self.path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+        log.debug("Saved checkpoint", path=str(self.path), keys=len(state))
+
+    def load(self) -> bool:
+        """Load any saved state for the registered handlers. Returns if it loaded."""
+        if self.path is None or not self.path.exists():
+            return False
+        try:
+            with self.path.open("rb") as f:
+                state = pickle.load(f)
+        except Exception:
+            log.exception("Unable to read checkpoint", path=str(self.path))
+            return False
+        for name, (_, load) in self.handlers.items():
+            if name not in state:
+                continue
+            try:
+                load(state[name])
+            except Exception:
+                log.exception("Unable to load checkpoint", name=name)
+        self.loaded = True
+        log.info("Loaded checkpoint", path=str(self.path), keys=len(state))
+        return True
+
+
+CHECKPOINT = Checkpoint(os.environ.get("STATE_PATH"))
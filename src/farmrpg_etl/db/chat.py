@@ -1,26 +1,193 @@
-import sqlite3
+import asyncio
+from collections import defaultdict
+from datetime import datetime
 
-import asyncpg
+import attrs
 import structlog
+from sqlalchemy.dialects.postgresql import insert
 
-from ..db import objects
+from ..db import database
 from ..events import EVENTS
-from ..models.chat import Message
+from ..models.chat import UNRESOLVED_ID_PREFIX, Message
+from ..utils.batch import BatchWriter
+from ..utils.cache import FixedSizeCache
 
 log = structlog.stdlib.get_logger(mod="db.chat")
 
+# Last flag count written for each (room, username, ts).
+FlagKey = tuple[str, str, datetime]
+last_flags = FixedSizeCache[FlagKey, int](10000, name="last_flags")
 
-@EVENTS.on("chat")
+
+class MessageIDResolver:
+    """Find the real message ID for flags, which only have a room, username and ts.
+
+    Messages seen in chat are indexed in memory and anything else is looked up in
+    the database. Keys which aren't in the database either aren't looked up again
+    for negative_ttl seconds.
+    """
+
+    def __init__(self, size: int = 10000, negative_ttl: float = 60) -> None:
+        self.ids = FixedSizeCache[FlagKey, str](size, policy="lru", name="message_ids")
+        self.missing = FixedSizeCache[FlagKey, bool](size, ttl=negative_ttl)
+
+    def add(self, msg: Message) -> None:
+        self.ids[(msg.room, msg.username, msg.ts)] = msg.id
+
+    async def resolve(self, room: str, msgs: list[Message]) -> None:
+        """Set the ID of each message in place, all in one query if needed."""
+        lookup: list[Message] = []
+        for msg in msgs:
+            key = (room, msg.username, msg.ts)
+            msg_id = self.ids.get(key)
+            if msg_id is not None:
+                msg.id = msg_id
+            elif key not in self.missing:
+                lookup.append(msg)
+        if not lookup:
+            return
+        rows = await database.fetch_all(
+            query=(
+                "SELECT id, username, ts FROM message WHERE room = :room"
+                " AND ts = ANY(CAST(:ts AS TIMESTAMPTZ[]))"
+            ),
+            values={"room": room, "ts": list({msg.ts for msg in lookup})},
+        )
+        found = {(row["username"], row["ts"]): row["id"] for row in rows}
+        for msg in lookup:
+            key = (room, msg.username, msg.ts)
+            msg_id = found.get((msg.username, msg.ts))
+            if msg_id is None:
+                self.missing[key] = True
+            else:
+                self.ids[key] = msg.id = msg_id
+
+
+message_ids = MessageIDResolver()
+
+
+async def _write_messages(msgs: list[Message]) -> None:
+    table = Message.orm_model.table  # type: ignore
+    # Events for a message arrive in order, so the last copy is the newest. Postgres
+    # won't update the same row twice in one statement.
+    rows = list({msg.id: attrs.asdict(msg, recurse=False) for msg in msgs}.values())
+    stmt = insert(table).values(rows)
+    # Conflicts are duplicate messages, this is fine unless it has been deleted since.
+    await database.execute(
+        stmt.on_conflict_do_update(
+            index_elements=["id"],
+            set_={
+                "deleted": stmt.excluded.deleted,
+                "deleted_ts": stmt.excluded.deleted_ts,
+            },
+            where=stmt.excluded.deleted & ~table.c.deleted,
+        )
+    )
+
+
+# Flags can arrive before their message has been written, so retry the ones that
+# didn't match anything a few times before giving up.
+FLAG_RETRIES = 5
+FLAG_RETRY_DELAY = 5.0
+flag_attempts = FixedSizeCache[FlagKey, int](10000)
+_retry_tasks: set[asyncio.Task] = set()
+
+
+async def _retry_flags(msgs: list[Message]) -> None:
+    await asyncio.sleep(FLAG_RETRY_DELAY)
+    for msg in msgs:
+        # Something newer has already been written.
+        if (msg.room, msg.username, msg.ts) in last_flags:
+            continue
+        await flags_writer.add(msg)
+
+
+async def _write_flags(msgs: list[Message]) -> None:
+    # Make sure any messages which are already queued exist first.
+    await message_writer.flush()
+    by_room: dict[str, dict[tuple[str, datetime], Message]] = defaultdict(dict)
+    for msg in msgs:
+        by_room[msg.room][(msg.username, msg.ts)] = msg
+    retry: list[Message] = []
+    for room, flags in by_room.items():
+        rows = []
+        values: dict[str, object] = {"room": room}
+        for i, ((username, ts), msg) in enumerate(flags.items()):
+            # Explicit casts because Postgres can't infer types inside VALUES.
+            rows.append(
+                f"(:username_{i}, CAST(:ts_{i} AS TIMESTAMPTZ),"
+                f" CAST(:flags_{i} AS INTEGER))"
+            )
+            values.update(
+                {f"username_{i}": username, f"ts_{i}": ts, f"flags_{i}": msg.flags}
+            )
+        updated = await database.fetch_all(
+            query=(
+                "UPDATE message SET flags = v.flags"
+                f" FROM (VALUES {', '.join(rows)}) AS v (username, ts, flags)"
+                " WHERE message.room = :room AND message.username = v.username"
+                " AND message.ts = v.ts"
+                " RETURNING message.username, message.ts"
+            ),
+            values=values,
+        )
+        matched = {(row["username"], row["ts"]) for row in updated}
+        for (username, ts), msg in flags.items():
+            key = (room, username, ts)
+            if (username, ts) in matched:
+                last_flags[key] = msg.flags
+                flag_attempts.pop(key, None)
+                continue
+            attempts = flag_attempts.pop(key, 0) + 1
+            if attempts > FLAG_RETRIES:
+                log.warning(
+                    "Dropping flags for unknown message", room=room, username=username
+                )
+                continue
+            flag_attempts[key] = attempts
+            retry.append(msg)
+    if retry:
+        task = asyncio.create_task(_retry_flags(retry), name="retry-flags")
+        _retry_tasks.add(task)
+        task.add_done_callback(_retry_tasks.discard)
+
+
+async def load_recent_messages(rooms: list[str], limit: int) -> list[Message]:
+    """Load the latest messages in each room, and remember their IDs and flags."""
+    columns = [f.name for f in attrs.fields(Message)]
+    rows = await database.fetch_all(
+        query=(
+            f"SELECT {', '.join(f'm.{c}' for c in columns)}"
+            " FROM unnest(CAST(:rooms AS TEXT[])) AS r (room)"
+            " CROSS JOIN LATERAL (SELECT * FROM message WHERE message.room = r.room"
+            " ORDER BY ts DESC LIMIT :limit) AS m"
+        ),
+        values={"rooms": rooms, "limit": limit},
+    )
+    msgs = [Message(**{c: row[c] for c in columns}) for row in rows]
+    for msg in msgs:
+        last_flags[(msg.room, msg.username, msg.ts)] = msg.flags
+        message_ids.add(msg)
+    return msgs
+
+
+message_writer = BatchWriter("message", _write_messages)
+flags_writer = BatchWriter("flags", _write_flags, max_delay=1)
+
+
+# The source of truth, so scrapers wait for space rather than lose anything.
+@EVENTS.on("chat", policy="block", partition=lambda msg: (msg.room, msg.id))
 async def on_chat(msg: Message):
-    try:
-        await objects(Message).create(msg)
-    # TODO This should be a SQLAlchemy error once I ditch databases/orm.
-    except (sqlite3.IntegrityError, asyncpg.exceptions.UniqueViolationError):
-        pass  # Duplicate message, this is fine.
+    message_ids.add(msg)
+    await message_writer.add(msg)
 
 
-@EVENTS.on("flags")
+@EVENTS.on(
+    "flags",
+    policy="block",
+    partition=lambda msg: (msg.room, msg.username, msg.ts),
+)
 async def on_flag(msg: Message):
-    await objects(Message).filter(
-        room=msg.room, username=msg.username, ts=msg.ts
-    ).update(flags=msg.flags)
+    if last_flags.get((msg.room, msg.username, msg.ts)) == msg.flags:
+        return
+    await flags_writer.add(msg)
@@ -1,40 +1,132 @@
-import cattrs
+import os
+
+import attrs
+import sqlalchemy
 import structlog
+from sqlalchemy.dialects.postgresql import insert
 
-from ..db import objects
+from ..db import database, objects
 from ..events import EVENTS
+from ..http import client
 from ..models.user import User, UserSnapshot
+from ..utils.batch import BatchWriter
+from ..utils.cache import FixedSizeCache
 
 log = structlog.stdlib.get_logger(mod="db.user")
 
+# Fields which are allowed to vary between otherwise identical snapshots.
+IGNORED_FIELDS = {"user", "ts"}
+COMPARED_FIELDS = [
+    f.name for f in attrs.fields(UserSnapshot) if f.name not in IGNORED_FIELDS
+]
 
-@EVENTS.on("user_snapshot")
-async def on_snap(snap: UserSnapshot):
-    # Get the latest snapshot for this user (if any) and try to diff them. Later on this
-    # will help cut down on no-op Firestore writes but for now it just avoids clogging
-    # the database.
-    user_id = snap.user.id
-    last_snap = await objects(UserSnapshot).order_by("-ts").first(user__id=user_id)
-    if last_snap is not None:
-        # Check if we need to proceed.
-        last_snap_data = cattrs.unstructure(last_snap)
-        snap_data = cattrs.unstructure(snap)
-        # Delete some fields which are allowed to vary.
-        last_snap_data.pop("user")
-        snap_data.pop("user")
-        last_snap_data.pop("ts")
-        snap_data.pop("ts")
-        if last_snap_data == snap_data:
-            log.debug(
-                "Skipping user snapshot save, no-op",
-                user_id=user_id,
-                username=snap.username,
-            )
-            return
-    snap.user, _ = await objects(User).get_or_create(id=user_id, defaults={})
+# Latest snapshot for each user ID.
+latest_snaps = FixedSizeCache[int, UserSnapshot](
+    int(os.environ.get("SNAPSHOT_CACHE_SIZE", "50000")),
+    policy="lru",
+    name="latest_snaps",
+)
+
+
+def _compare_key(snap: UserSnapshot) -> tuple:
+    return tuple(getattr(snap, name) for name in COMPARED_FIELDS)
+
+
+async def _latest_snap(user_id: int) -> UserSnapshot | None:
+    snap = latest_snaps.get(user_id)
+    if snap is None:
+        snap = await objects(UserSnapshot).order_by("-ts").first(user__id=user_id)
+        if snap is not None:
+            latest_snaps[user_id] = snap
+    return snap
+
+
+@EVENTS.on("startup")
+async def on_startup():
+    # Warm the cache with the most recently active users.
+    rows = await database.fetch_all(
+        query=(
+            "SELECT * FROM ("
+            'SELECT DISTINCT ON ("user") "user", ts, username, is_farmhand, is_ranger'
+            ' FROM user_snapshot ORDER BY "user", ts DESC'
+            ") AS latest ORDER BY ts DESC LIMIT :limit"
+        ),
+        values={"limit": latest_snaps.max_size},
+    )
+    # Oldest first so the newest are the last to be evicted.
+    for row in sorted(rows, key=lambda row: row["ts"]):
+        latest_snaps[row["user"]] = UserSnapshot(
+            user=User(id=row["user"]),
+            ts=row["ts"],
+            username=row["username"],
+            is_farmhand=row["is_farmhand"],
+            is_ranger=row["is_ranger"],
+        )
+    log.info("Loaded latest user snapshots", count=len(rows))
+
+
+# A new snapshot along with the one it replaces.
+PendingSnap = tuple[UserSnapshot, UserSnapshot | None]
+
+
+async def _write_snaps(pending: list[PendingSnap]) -> None:
+    user_table = User.orm_model.table  # type: ignore
+    snap_table = UserSnapshot.orm_model.table  # type: ignore
+    user_ids = list({snap.user.id for snap, _ in pending})
     try:
-        await objects(UserSnapshot).create(snap)
+        async with database.transaction():
+            await database.execute(
+                insert(user_table)
+                .values([{"id": user_id} for user_id in user_ids])
+                .on_conflict_do_nothing(index_elements=["id"])
+            )
+            # Need the Firebase UIDs for new_user_snapshot.
+            users = {
+                row["id"]: User(id=row["id"], firebase_uid=row["firebase_uid"])
+                for row in await database.fetch_all(
+                    sqlalchemy.select(user_table).where(user_table.c.id.in_(user_ids))
+                )
+            }
+            await database.execute(
+                insert(snap_table).values(
+                    [
+                        attrs.asdict(snap, recurse=False) | {"user": snap.user.id}
+                        for snap, _ in pending
+                    ]
+                )
+            )
     except Exception:
-        log.exception("Error saving snapshot", username=snap.username, user_id=user_id)
+        # Make sure these get compared against the database next time, and that
+        # the profiles aren't skipped as unchanged.
+        for user_id in user_ids:
+            latest_snaps.pop(user_id, None)
+        for snap, _ in pending:
+            client.invalidate("profile.php", params={"user_name": snap.username})
         raise
-    EVENTS.emit("new_user_snapshot", snap=snap, last_snap=last_snap)
+    for snap, last_snap in pending:
+        snap.user = users[snap.user.id]
+        await EVENTS.emit("new_user_snapshot", snap=snap, last_snap=last_snap)
+
+
+# An online sweep spaces out profile fetches, so wait a while to fill batches.
+snap_writer = BatchWriter[PendingSnap](
+    "user_snapshot", _write_snaps, max_size=1000, max_delay=5
+)
+
+
+@EVENTS.on("user_snapshot", policy="block", partition=lambda snap: snap.user.id)
+async def on_snap(snap: UserSnapshot):
+    # Compare with the latest snapshot for this user (if any) to skip no-ops. Later on
+    # this will help cut down on no-op Firestore writes but for now it just avoids
+    # clogging the database.
+    user_id = snap.user.id
+    last_snap = await _latest_snap(user_id)
+    if last_snap is not None and _compare_key(last_snap) == _compare_key(snap):
+        log.debug(
+            "Skipping user snapshot save, no-op",
+            user_id=user_id,
+            username=snap.username,
+        )
+        return
+    latest_snaps[user_id] = snap
+    await snap_writer.add((snap, last_snap))
@@ -1,50 +1,272 @@
 import asyncio
 from collections import defaultdict
-from typing import Callable, Coroutine, TypeVar, overload
+from typing import Any, Callable, Coroutine, Hashable, Literal, TypeVar, overload
 
 import structlog
 
+from .metrics import METRICS
+from .utils.cache import FixedSizeCache
+from .utils.spill import SpillQueue
+
 A = TypeVar("A", bound=Callable[..., Coroutine])
 
+# What to do when a listener's queue is full.
+#   block: emit() waits for space.
+#   drop_oldest: throw away the oldest queued event.
+#   spill: queue the overflow on disk, events must be picklable.
+Policy = Literal["block", "drop_oldest", "spill"]
+
+QUEUE_DEPTH = METRICS.gauge(
+    "events_queue_depth", "Events waiting to be handled by each listener."
+)
+DROPPED = METRICS.counter(
+    "events_dropped_total", "Events dropped because a listener's queue was full."
+)
+IN_FLIGHT = METRICS.gauge(
+    "events_in_flight", "Events currently being handled by each listener."
+)
+SPILLED = METRICS.counter(
+    "events_spilled_total",
+    "Events spilled to disk because a listener's queue was full.",
+)
 
 log = structlog.stdlib.get_logger(mod="events")
 
 
+Item = tuple[tuple, dict[str, Any]]
+
+
+class Shard:
+    """One bounded queue of events for a listener."""
+
+    def __init__(self, listener: "Listener", maxsize: int) -> None:
+        self.listener = listener
+        self.queue: asyncio.Queue[Item] = asyncio.Queue(maxsize)
+        self.spill: SpillQueue[Item] | None = None
+
+    @property
+    def pending(self) -> int:
+        return self.queue.qsize() + (len(self.spill) if self.spill else 0)
+
+    def _refill(self) -> None:
+        while self.spill and not self.queue.full():
+            self.queue.put_nowait(self.spill.popleft())
+
+    async def put(self, item: Item) -> None:
+        policy = self.listener.policy
+        labels = {"key": self.listener.key, "listener": self.listener.name}
+        if policy == "block":
+            await self.queue.put(item)
+        elif policy == "drop_oldest":
+            if self.queue.full():
+                self.queue.get_nowait()
+                self.queue.task_done()
+                DROPPED.inc(**labels)
+            self.queue.put_nowait(item)
+        elif policy == "spill":
+            # Once anything has spilled, keep spilling so events stay in order.
+            if self.spill or self.queue.full():
+                if self.spill is None:
+                    self.spill = SpillQueue()
+                self.spill.append(item)
+                SPILLED.inc(**labels)
+            else:
+                self.queue.put_nowait(item)
+        else:
+            raise ValueError(f"Unknown overflow policy {policy!r}")
+
+    async def get(self) -> Item:
+        item = await self.queue.get()
+        self._refill()
+        return item
+
+    async def join(self) -> None:
+        await self.queue.join()
+        # Spilled events are moved to the queue as it drains, so this only
+        # loops if more were emitted while we were waiting.
+        while self.pending:
+            await self.queue.join()
+
+
+class Listener:
+    """A handler with its own bounded queue and pool of workers.
+
+    If partition is given, it is called with each event's arguments and events
+    with the same partition key are handled one at a time in the order they
+    were emitted. Each of the concurrency workers then has its own queue of
+    up to maxsize events, rather than sharing one.
+    """
+
+    def __init__(
+        self,
+        key: str,
+        fn: Callable[..., Coroutine],
+        *,
+        maxsize: int = 1000,
+        policy: Policy = "block",
+        concurrency: int = 10,
+        partition: Callable[..., Hashable] | None = None,
+    ) -> None:
+        self.key = key
+        self.fn = fn
+        self.policy = policy
+        self.concurrency = concurrency
+        self.partition = partition
+        # Sinks for different stores share function names, so include the module.
+        qualname = getattr(fn, "__qualname__", None)
+        self.name = f"{fn.__module__}.{qualname}" if qualname else repr(fn)
+        self.shards = [
+            Shard(self, maxsize) for _ in range(concurrency if partition else 1)
+        ]
+        self.workers: list[asyncio.Task] = []
+
+    @property
+    def pending(self) -> int:
+        return sum(shard.pending for shard in self.shards)
+
+    def _update_depth(self) -> None:
+        QUEUE_DEPTH.set(self.pending, key=self.key, listener=self.name)
+
+    def _start(self) -> None:
+        while len(self.workers) < self.concurrency:
+            shard = self.shards[len(self.workers) % len(self.shards)]
+            self.workers.append(
+                asyncio.create_task(self._work(shard), name=f"listener-{self.name}")
+            )
+
+    async def put(self, *args, **kwargs) -> None:
+        self._start()
+        if self.partition is None:
+            shard = self.shards[0]
+        else:
+            shard = self.shards[
+                hash(self.partition(*args, **kwargs)) % len(self.shards)
+            ]
+        await shard.put((args, kwargs))
+        self._update_depth()
+
+    async def _work(self, shard: Shard) -> None:
+        while True:
+            args, kwargs = await shard.get()
+            self._update_depth()
+            IN_FLIGHT.inc(key=self.key, listener=self.name)
+            try:
+                await self.fn(*args, **kwargs)
+            except Exception:
+                log.exception("Error in event listener", key=self.key, fn=self.name)
+            finally:
+                IN_FLIGHT.dec(key=self.key, listener=self.name)
+                shard.queue.task_done()
+
+    async def join(self) -> None:
+        """Wait until everything queued so far has been handled."""
+        for shard in self.shards:
+            await shard.join()
+
+    async def stop(self) -> None:
+        for task in self.workers:
+            task.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.workers.clear()
+
+
 class EventHub:
     def __init__(self) -> None:
-        self.listeners: dict[str, list[Callable[..., Coroutine]]] = defaultdict(list)
-
-    def emit(self, key: str, *args, **kwargs) -> bool:
-        found_handler = False
-        key_parts = key.split(".")
-        for i in range(len(key_parts), 0, -1):
-            partial_key = ".".join(key_parts[:i])
-            for listener in self.listeners[partial_key]:
-                asyncio.create_task(listener(*args, **kwargs))
-                found_handler = True
-        return found_handler
+        self.listeners: dict[str, list[Listener]] = defaultdict(list)
+        # Every listener for a full event key, most specific first. Cleared
+        # whenever a listener is added. Bounded because some keys come from user
+        # input, like bot_dm.{command}.
+        self._routes = FixedSizeCache[str, tuple[Listener, ...]](1000)
+
+    def _resolve(self, key: str) -> tuple[Listener, ...]:
+        routes = self._routes.get(key)
+        if routes is None:
+            key_parts = key.split(".")
+            found: list[Listener] = []
+            for i in range(len(key_parts), 0, -1):
+                found.extend(self.listeners.get(".".join(key_parts[:i]), ()))
+            routes = tuple(found)
+            if routes:
+                self._routes[key] = routes
+        return routes
+
+    async def emit(self, key: str, *args, **kwargs) -> bool:
+        routes = self._resolve(key)
+        for listener in routes:
+            await listener.put(*args, **kwargs)
+        return bool(routes)
+
+    async def drain(self) -> None:
+        """Wait for all queued events to be handled, then stop the workers."""
+        for listeners in list(self.listeners.values()):
+            for listener in listeners:
+                await listener.join()
+        for listeners in list(self.listeners.values()):
+            for listener in listeners:
+                await listener.stop()
 
     @overload
-    def on(self, key_pattern: str) -> Callable[[A], A]:
+    def on(
+        self,
+        key_pattern: str,
+        *,
+        maxsize: int = ...,
+        policy: Policy = ...,
+        concurrency: int = ...,
+        partition: Callable[..., Hashable] | None = ...,
+    ) -> Callable[[A], A]:
         ...
 
     @overload
-    def on(self, key_pattern: str, fn: Callable[..., Coroutine]) -> None:
+    def on(
+        self,
+        key_pattern: str,
+        fn: Callable[..., Coroutine],
+        *,
+        maxsize: int = ...,
+        policy: Policy = ...,
+        concurrency: int = ...,
+        partition: Callable[..., Hashable] | None = ...,
+    ) -> None:
         ...
 
     def on(
-        self, key_pattern: str, fn: Callable[..., Coroutine] | None = None
+        self,
+        key_pattern: str,
+        fn: Callable[..., Coroutine] | None = None,
+        *,
+        maxsize: int = 1000,
+        policy: Policy = "block",
+        concurrency: int = 10,
+        partition: Callable[..., Hashable] | None = None,
     ) -> Callable[[A], A] | None:
         if fn is None:
 
             def decorator(fn: A) -> A:
-                self.on(key_pattern, fn)
+                self.on(
+                    key_pattern,
+                    fn,
+                    maxsize=maxsize,
+                    policy=policy,
+                    concurrency=concurrency,
+                    partition=partition,
+                )
                 return fn
 
             return decorator
         else:
             # log.debug("Adding listener", key=key_pattern, fn=fn)
-            self.listeners[key_pattern].append(fn)
+            self._routes.clear()
+            self.listeners[key_pattern].append(
+                Listener(
+                    key_pattern,
+                    fn,
+                    maxsize=maxsize,
+                    policy=policy,
+                    concurrency=concurrency,
+                    partition=partition,
+                )
+            )
 
 
 EVENTS = EventHub()
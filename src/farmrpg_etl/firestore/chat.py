@@ -1,13 +1,15 @@
 import re
-from collections import defaultdict
+from typing import Any
 
+import attrs
 import cattrs
 import structlog
 from google.cloud import firestore
 
+from ..checkpoint import CHECKPOINT
 from ..events import EVENTS
-from ..models.chat import Message
-from ..utils.cache import FixedSizeCache
+from ..models.chat import UNRESOLVED_ID_PREFIX, Message
+from ..utils.batch import BatchWriter
 from ..utils.datetime import now
 
 MENTION_RE = re.compile(r"@([^:\s]+(?:[^:]{0,29}?[^:\s](?=:))?)")
@@ -19,15 +21,44 @@ rooms_col = db.collection("rooms")
 log = structlog.stdlib.get_logger(mod="firestore.chat")
 
 
-# A cache used to mapping message IDs on flags because it's not (yet) included.
-MessageIDCache = FixedSizeCache[str, str]
-id_map = defaultdict[str, MessageIDCache](lambda: MessageIDCache(110))
-
-
 # A set of all existing room docs to be used to avoid extraneous writes.
 room_docs: set[str] = set()
 
 
+CHECKPOINT.register("firestore.chat", lambda: room_docs, room_docs.update)
+
+
+@attrs.define
+class SetOp:
+    ref: firestore.AsyncDocumentReference
+    data: dict[str, Any]
+    merge: bool = False
+
+
+def _coalesce(ops: list[SetOp]) -> list[SetOp]:
+    """Combine writes to the same document, relying on them being in order."""
+    by_path: dict[str, SetOp] = {}
+    for op in ops:
+        prev = by_path.get(op.ref.path)
+        if prev is not None and op.merge:
+            op = SetOp(op.ref, {**prev.data, **op.data}, merge=prev.merge)
+        # Re-insert so the document is written at its latest position.
+        by_path.pop(op.ref.path, None)
+        by_path[op.ref.path] = op
+    return list(by_path.values())
+
+
+async def _commit(ops: list[SetOp]) -> None:
+    batch = db.batch()
+    for op in _coalesce(ops):
+        batch.set(op.ref, op.data, merge=op.merge)
+    await batch.commit()
+
+
+# Firestore allows at most 500 writes per batch.
+writer = BatchWriter("firestore", _commit, max_size=500, max_retries=3)
+
+
 @EVENTS.on("startup")
 async def on_startup():
     docs = rooms_col.stream()  # type: ignore stream() has a mission Optional[]
@@ -36,7 +67,9 @@ async def on_startup():
     log.info("Found room docs", rooms=list(room_docs))
 
 
-@EVENTS.on("chat")
+# Postgres is the source of truth, so a stalled Firestore spills its backlog to
+# disk rather than holding up the scrapers.
+@EVENTS.on("chat", policy="spill", partition=lambda msg: (msg.room, msg.id))
 async def on_chat(msg: Message):
     data = cattrs.unstructure(msg)
     # We don't want to touch the flags count here.
@@ -46,33 +79,34 @@ async def on_chat(msg: Message):
         del data["deleted_ts"]
     # Find any mentions so we can query on those.
     data["mentions"] = MENTION_RE.findall(msg.content)
-    doc_ref = rooms_col.document(msg.room).collection("chats").document(msg.id)
-    await doc_ref.set(data, merge=True)
-    id_map[msg.room][f"{msg.ts}|{msg.username}"] = msg.id
     # Create the room doc if needed.
     if msg.room not in room_docs:
-        room_dof_ref = rooms_col.document(msg.room)
-        await room_dof_ref.set({"id": msg.room})  # type: ignore another bad Optional[]
         room_docs.add(msg.room)
+        await writer.add(SetOp(rooms_col.document(msg.room), {"id": msg.room}))
+    doc_ref = rooms_col.document(msg.room).collection("chats").document(msg.id)
+    await writer.add(SetOp(doc_ref, data, merge=True))
 
 
-@EVENTS.on("flags")
+@EVENTS.on(
+    "flags",
+    policy="spill",
+    partition=lambda msg: (msg.room, msg.username, msg.ts),
+)
 async def on_flag(msg: Message):
-    msg_id = id_map[msg.room].get(f"{msg.ts}|{msg.username}")
-    if msg_id is not None:
-        doc_ref = (
-            rooms_col.document(msg.room)
-            .collection("chats")
-            .document(msg_id)
-            .collection("mod")
-            .document("flags")
-        )
-        log.debug("Writing flags", msg_id=msg_id, flags=msg.flags)
-        await doc_ref.set({"flags": msg.flags, "ts": now()})
-    else:
+    if msg.id.startswith(UNRESOLVED_ID_PREFIX):
         log.warn(
             "Unable to find message ID for flags",
             room=msg.room,
             username=msg.username,
             ts=msg.ts,
         )
+        return
+    doc_ref = (
+        rooms_col.document(msg.room)
+        .collection("chats")
+        .document(msg.id)
+        .collection("mod")
+        .document("flags")
+    )
+    log.debug("Writing flags", msg_id=msg.id, flags=msg.flags)
+    await writer.add(SetOp(doc_ref, {"flags": msg.flags, "ts": now()}))
@@ -3,7 +3,7 @@ from ..firebase import set_custom_user_claims
 from ..models.user import UserSnapshot, get_custom_claims
 
 
-@EVENTS.on("new_user_snapshot")
+@EVENTS.on("new_user_snapshot", policy="spill")
 async def on_snap(snap: UserSnapshot, last_snap: UserSnapshot | None):
     # If they have a Firebase ID, update any custom claims.
     if snap.user.firebase_uid:
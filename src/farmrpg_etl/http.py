@@ -1,16 +1,217 @@
+import contextlib
+import contextvars
+import enum
+import hashlib
 import os
+import time
+from typing import Any, Iterator
 
+import attrs
 import httpx
 
+from .metrics import METRICS
+from .utils.cache import FixedSizeCache
+from .utils.ratelimit import PriorityRateLimiter
+
+
+class Lane(enum.IntEnum):
+    """Request priorities, lower numbers go first when rate limited."""
+
+    CHAT = 0
+    MAILBOX = 1
+    FLAGS = 2
+    PROFILE = 3
+
+
+_lane = contextvars.ContextVar("http_lane", default=Lane.PROFILE)
+
+
+@contextlib.contextmanager
+def lane(new_lane: Lane) -> Iterator[None]:
+    """Set the priority for any requests made inside this block."""
+    token = _lane.set(new_lane)
+    try:
+        yield
+    finally:
+        _lane.reset(token)
+
+
+QUEUE_TIME = METRICS.histogram(
+    "http_queue_seconds", "Time spent waiting on the rate limiter."
+)
+CONNECT_TIME = METRICS.histogram(
+    "http_connect_seconds", "Time to open a new connection, including TLS."
+)
+TTFB_TIME = METRICS.histogram(
+    "http_ttfb_seconds", "Time from sending a request to receiving response headers."
+)
+TOTAL_TIME = METRICS.histogram(
+    "http_request_seconds", "Time from sending a request to reading the full body."
+)
+CACHE_REQUESTS = METRICS.counter(
+    "http_cache_requests_total", "Cached GET requests, by how they were served."
+)
+
+# Shared by both clients since they hit the same server.
+limiter = PriorityRateLimiter(
+    rate=float(os.environ.get("HTTP_RATE_LIMIT", "20")),
+    burst=float(os.environ.get("HTTP_RATE_BURST", "10")),
+    concurrency=int(os.environ.get("HTTP_CONCURRENCY", "10")),
+)
+
+
+# Headers describing the encoding on the wire, which don't apply to the decoded body.
+WIRE_HEADERS = {"content-encoding", "content-length", "transfer-encoding"}
+
+
+def _cacheable_headers(headers: httpx.Headers) -> dict[str, str]:
+    return {k: v for k, v in headers.items() if k.lower() not in WIRE_HEADERS}
+
+
+@attrs.define
+class CacheEntry:
+    digest: bytes
+    fetched: float
+    etag: str | None = None
+    last_modified: str | None = None
+    # Only kept when needed to answer from the cache, pages can be big.
+    content: bytes | None = None
+    headers: dict[str, str] = attrs.Factory(dict)
+
+
+class ScraperClient(httpx.AsyncClient):
+    def __init__(
+        self,
+        *args,
+        cache_size: int = 5000,
+        cache_bytes: int | None = None,
+        **kwargs,
+    ) -> None:
+        super().__init__(*args, **kwargs)
+        self.cache = FixedSizeCache[str, CacheEntry](
+            cache_size,
+            policy="lru",
+            max_bytes=cache_bytes,
+            sizeof=lambda entry: len(entry.content or b""),
+            name="http",
+        )
+
+    async def get_cached(
+        self, url: str, *, params: dict[str, str] | None = None, ttl: float = 0
+    ) -> tuple[httpx.Response, bool]:
+        """GET a page, also returning if it changed since the last time we saw it.
+
+        Uses a conditional request if the server gave us an ETag or Last-Modified,
+        otherwise the hash of the body is compared. If the page was fetched less
+        than ttl seconds ago, it is returned from the cache without a request.
+        """
+        request = self.build_request("GET", url, params=params)
+        key = str(request.url)
+        entry = self.cache.get(key)
+        now = time.monotonic()
+        if entry is not None and entry.content is not None:
+            if now - entry.fetched < ttl:
+                CACHE_REQUESTS.inc(result="fresh")
+                return self._cached_response(request, entry), False
+            if entry.etag is not None:
+                request.headers["If-None-Match"] = entry.etag
+            if entry.last_modified is not None:
+                request.headers["If-Modified-Since"] = entry.last_modified
+
+        response = await self.send(request)
+        if response.status_code == 304 and entry is not None and entry.content:
+            entry.fetched = now
+            CACHE_REQUESTS.inc(result="not_modified")
+            return self._cached_response(request, entry), False
+        if response.status_code != 200:
+            return response, True
+
+        digest = hashlib.blake2b(response.content, digest_size=16).digest()
+        changed = entry is None or entry.digest != digest
+        etag = response.headers.get("ETag")
+        last_modified = response.headers.get("Last-Modified")
+        keep = ttl > 0 or etag is not None or last_modified is not None
+        self.cache[key] = CacheEntry(
+            digest=digest,
+            fetched=now,
+            etag=etag,
+            last_modified=last_modified,
+            content=response.content if keep else None,
+            headers=_cacheable_headers(response.headers) if keep else {},
+        )
+        CACHE_REQUESTS.inc(result="changed" if changed else "unchanged")
+        return response, changed
+
+    def invalidate(self, url: str, *, params: dict[str, str] | None = None) -> None:
+        """Forget a cached page, e.g. because processing it failed."""
+        self.cache.pop(str(self.build_request("GET", url, params=params).url), None)
+
+    def _cached_response(
+        self, request: httpx.Request, entry: CacheEntry
+    ) -> httpx.Response:
+        return httpx.Response(
+            200, headers=entry.headers, content=entry.content, request=request
+        )
+
+    async def send(
+        self, request: httpx.Request, *, stream: bool = False, **kwargs
+    ) -> httpx.Response:
+        request_lane = _lane.get()
+        labels = {
+            "endpoint": request.url.path.lstrip("/"),
+            "lane": request_lane.name.lower(),
+        }
+        # Timestamps for each connection event, filled in by httpcore.
+        events: dict[str, float] = {}
+
+        async def trace(event: str, info: dict[str, Any]) -> None:
+            events[event] = time.perf_counter()
+
+        request.extensions.setdefault("trace", trace)
+
+        queued = time.perf_counter()
+        async with limiter.limit(request_lane):
+            start = time.perf_counter()
+            QUEUE_TIME.observe(start - queued, **labels)
+            response = await super().send(request, stream=True, **kwargs)
+            TTFB_TIME.observe(time.perf_counter() - start, **labels)
+            if not stream:
+                try:
+                    await response.aread()
+                except BaseException:
+                    await response.aclose()
+                    raise
+                TOTAL_TIME.observe(time.perf_counter() - start, **labels)
+
+        connect_start = events.get("connection.connect_tcp.started")
+        connect_end = events.get("connection.start_tls.complete") or events.get(
+            "connection.connect_tcp.complete"
+        )
+        if connect_start is not None and connect_end is not None:
+            CONNECT_TIME.observe(connect_end - connect_start, **labels)
+        return response
+
 
 def _client(cookie: str) -> httpx.AsyncClient:
-    return httpx.AsyncClient(
+    return ScraperClient(
         base_url="https://farmrpg.com/",
         cookies={"HighwindFRPG": cookie},
         headers={
             "Referer": "https://farmrpg.com/",
             "User-Agent": "farmrpg-etl (contact coderanger)",
         },
+        limits=httpx.Limits(
+            max_connections=int(os.environ.get("HTTP_MAX_CONNECTIONS", "20")),
+            max_keepalive_connections=int(os.environ.get("HTTP_MAX_KEEPALIVE", "10")),
+            keepalive_expiry=float(os.environ.get("HTTP_KEEPALIVE_EXPIRY", "60")),
+        ),
+        timeout=httpx.Timeout(
+            float(os.environ.get("HTTP_TIMEOUT", "10")),
+            connect=float(os.environ.get("HTTP_CONNECT_TIMEOUT", "5")),
+        ),
+        # Bodies are only kept for pages with validators or a TTL.
+        cache_bytes=int(os.environ.get("HTTP_CACHE_BYTES", str(64 * 1024 * 1024))),
+        http2=os.environ.get("HTTP2") == "true",
     )
 
 
@@ -0,0 +1,163 @@
+import attrs
+
+# Label values sorted by label name, so they can be used as a dict key.
+Labels = tuple[tuple[str, str], ...]
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _labels(labels: dict[str, str]) -> Labels:
+    return tuple(sorted(labels.items()))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(value)
+
+
+@attrs.define
+class Counter:
+    name: str
+    help: str
+    values: dict[Labels, float] = attrs.Factory(dict)
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = _labels(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, **labels: str) -> float:
+        return self.values.get(_labels(labels), 0)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for labels, value in self.values.items():
+            lines.append(f"{self.name}{_format_labels(labels)} {_format_value(value)}")
+        return lines
+
+
+@attrs.define
+class Gauge:
+    name: str
+    help: str
+    values: dict[Labels, float] = attrs.Factory(dict)
+
+    def set(self, value: float, **labels: str) -> None:
+        self.values[_labels(labels)] = value
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = _labels(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels: str) -> None:
+        self.inc(-amount, **labels)
+
+    def get(self, **labels: str) -> float:
+        return self.values.get(_labels(labels), 0)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        for labels, value in self.values.items():
+            lines.append(f"{self.name}{_format_labels(labels)} {_format_value(value)}")
+        return lines
+
+
+@attrs.define
+class HistogramValue:
+    # Count of observations in each bucket, not cumulative.
+    buckets: list[int]
+    sum: float = 0
+    count: int = 0
+
+
+@attrs.define
+class Histogram:
+    name: str
+    help: str
+    buckets: tuple[float, ...] = DEFAULT_BUCKETS
+    values: dict[Labels, HistogramValue] = attrs.Factory(dict)
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = _labels(labels)
+        hist = self.values.get(key)
+        if hist is None:
+            hist = self.values[key] = HistogramValue([0] * len(self.buckets))
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                hist.buckets[i] += 1
+                break
+        hist.sum += value
+        hist.count += 1
+
+    def get(self, **labels: str) -> HistogramValue | None:
+        return self.values.get(_labels(labels))
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labels, hist in self.values.items():
+            # Prometheus buckets are cumulative, with a final +Inf bucket.
+            total = 0
+            for bound, count in zip(self.buckets, hist.buckets):
+                total += count
+                bucket_labels = labels + (("le", _format_value(bound)),)
+                lines.append(
+                    f"{self.name}_bucket{_format_labels(bucket_labels)} {total}"
+                )
+            lines.append(
+                f"{self.name}_bucket{_format_labels(labels + (('le', '+Inf'),))}"
+                f" {hist.count}"
+            )
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {hist.sum!r}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {hist.count}")
+        return lines
+
+
+Metric = Counter | Gauge | Histogram
+
+
+class MetricsRegistry:
+    def __init__(self) -> None:
+        self.metrics: dict[str, Metric] = {}
+
+    def counter(self, name: str, help: str) -> Counter:
+        metric = self.metrics.get(name)
+        if metric is None:
+            metric = self.metrics[name] = Counter(name, help)
+        assert isinstance(metric, Counter)
+        return metric
+
+    def gauge(self, name: str, help: str) -> Gauge:
+        metric = self.metrics.get(name)
+        if metric is None:
+            metric = self.metrics[name] = Gauge(name, help)
+        assert isinstance(metric, Gauge)
+        return metric
+
+    def histogram(
+        self, name: str, help: str, buckets: tuple[float, ...] = DEFAULT_BUCKETS
+    ) -> Histogram:
+        metric = self.metrics.get(name)
+        if metric is None:
+            metric = self.metrics[name] = Histogram(name, help, buckets)
+        assert isinstance(metric, Histogram)
+        return metric
+
+    def render(self) -> str:
+        """Render every metric in the Prometheus text format."""
+        lines = []
+        for metric in self.metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+METRICS = MetricsRegistry()
@@ -1,9 +1,15 @@
+import hashlib
+import sys
 from datetime import datetime
 
 import attrs
+import sqlalchemy
 
 from ..db import attrs_model
 
+# Flags don't include the message ID, this marks a placeholder until it's resolved.
+UNRESOLVED_ID_PREFIX = "unresolved:"
+
 
 @attrs_model(index=["!id", "room", "ts", "username", "flags", "deleted", "deleted_ts"])
 @attrs.define
@@ -17,3 +23,51 @@ class Message:
     flags: int = 0
     deleted: bool = False
     deleted_ts: datetime | None = None
+
+
+# For looking up flags by room and ts, and the latest messages in each room.
+sqlalchemy.Index(
+    "ix_message_room_ts",
+    Message.orm_model.table.c.room,  # type: ignore
+    Message.orm_model.table.c.ts,  # type: ignore
+)
+
+
+def _content_hash(content: str) -> bytes:
+    return hashlib.blake2b(content.encode(), digest_size=16).digest()
+
+
+@attrs.frozen
+class CompactMessage:
+    """A slimmer Message for in-memory scraper state.
+
+    Content is only needed to spot edits, so just its hash is kept, and the
+    strings repeated across messages are interned. Only for comparing with new
+    scrapes, events always get a full Message.
+    """
+
+    room: str
+    id: str
+    ts: datetime
+    emblem: str
+    username: str
+    content_hash: bytes
+    flags: int = 0
+    deleted: bool = False
+    deleted_ts: datetime | None = None
+
+    @classmethod
+    def of(cls, msg: "Message | CompactMessage") -> "CompactMessage":
+        if isinstance(msg, CompactMessage):
+            return msg
+        return cls(
+            room=sys.intern(msg.room),
+            id=msg.id,
+            ts=msg.ts,
+            emblem=sys.intern(msg.emblem),
+            username=sys.intern(msg.username),
+            content_hash=_content_hash(msg.content),
+            flags=msg.flags,
+            deleted=msg.deleted,
+            deleted_ts=msg.deleted_ts,
+        )
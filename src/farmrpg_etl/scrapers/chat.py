@@ -1,22 +1,29 @@
+import hashlib
 import re
 import time
 from datetime import datetime, timedelta
-from typing import Iterable, cast
+from typing import Any, Awaitable, Callable, Iterable, Literal, cast
 from zoneinfo import ZoneInfo
 
 import attrs
 import structlog
 from bs4 import BeautifulSoup, Tag
+from lxml import etree
 
+from ..checkpoint import Checkpoint
 from ..events import EVENTS
-from ..http import client
-from ..models.chat import Message
+from ..http import Lane, client, lane
+from ..metrics import METRICS
+from ..models.chat import UNRESOLVED_ID_PREFIX, CompactMessage, Message
+from ..utils import executor, html
 from .errors import ParseError
 
 UTC = ZoneInfo("UTC")
 SERVER_TIME = ZoneInfo("America/Chicago")
 
 MESSAGE_ID_RE = re.compile(r"^javascript:(?:un)?delChat\((\d+)\)$")
+CHAT_TXT_SPLIT_RE = re.compile(rb'(?=<div class="chat-txt)')
+FRAGMENT_ID_RE = re.compile(rb"javascript:(?:un)?delChat\((\d+)\)")
 FLAGS_RE = re.compile(r"^(\d+) flags?$")
 FORCEPATH_RE = re.compile(r"<strong>\w+path</strong>")
 AT_LINK_RE = re.compile(
@@ -25,15 +32,40 @@ AT_LINK_RE = re.compile(
 )
 
 
+# Compiled XPath equivalents of the selectors used in _parse_chat.
+CHAT_TXT_XPATH = etree.XPath(f"//div[{html.has_class('chat-txt')}]")
+TS_XPATH = etree.XPath("descendant::span[1]")
+CHIP_XPATH = etree.XPath(f"descendant::div[{html.has_class('chip')}][1]")
+MESSAGE_ID_A_XPATH = etree.XPath("following-sibling::a[1]")
+EMBLEM_XPATH = etree.XPath(
+    f"(descendant::div[{html.has_class('chip-media')}]/descendant::img)[1]"
+)
+ICONS_XPATH = etree.XPath(f"descendant::i[{html.has_class('f7-icons')}][1]")
+
+
+POLLS = METRICS.counter("chat_polls_total", "Chat and flags polls made.")
+SKIPPED_POLLS = METRICS.counter(
+    "chat_polls_skipped_total",
+    "Chat and flags polls skipped because the response was unchanged.",
+)
+
+
 log = structlog.stdlib.get_logger(mod="scrapers.chat")
 
 
-def _parse_chat(room: str, content: bytes) -> Iterable[Message]:
-    """Parse the chat HTML into models."""
+def _parse_chat(
+    room: str, content: bytes, last_ts: datetime | None = None
+) -> Iterable[Message]:
+    """Parse the chat HTML into models.
+
+    If given, last_ts is the timestamp of the message just before this content,
+    used when parsing part of a chat response.
+    """
     # This has a bunch of ugly casts because the type stubs for BS aren't great.
     # (or rather the interface isn't built for strong typing, sigh)
     root = BeautifulSoup(content, "lxml")
-    last_ts = datetime.now(tz=SERVER_TIME)
+    if last_ts is None:
+        last_ts = datetime.now(tz=SERVER_TIME)
     for elm in root.select("div.chat-txt"):
         # Parse out the timestamp, which is weirdly difficult.
         ts_elm = elm.select_one("span")
@@ -83,6 +115,105 @@ def _parse_chat(room: str, content: bytes) -> Iterable[Message]:
         )
 
 
+def _xpath_one(xpath: etree.XPath, elm: etree._Element) -> etree._Element | None:
+    found = cast(list[etree._Element], xpath(elm))
+    return found[0] if found else None
+
+
+def _parse_chat_lxml(
+    room: str, content: bytes, last_ts: datetime | None = None
+) -> Iterable[Message]:
+    """Parse the chat HTML into models using lxml directly.
+
+    This produces exactly the same output as _parse_chat but without building a
+    BeautifulSoup tree, which is much faster.
+    """
+    root = html.parse(content)
+    if root is None:
+        return
+    if last_ts is None:
+        last_ts = datetime.now(tz=SERVER_TIME)
+    for elm in cast(list[etree._Element], CHAT_TXT_XPATH(root)):
+        # Parse out the timestamp, which is weirdly difficult.
+        ts_elm = _xpath_one(TS_XPATH, elm)
+        if ts_elm is None:
+            raise ParseError(f"Unable to find timestamp: {content.decode()}")
+        ts = datetime.strptime(html.text(ts_elm).strip(), "%I:%M:%S %p").replace(
+            year=last_ts.year,
+            month=last_ts.month,
+            day=last_ts.day,
+            tzinfo=last_ts.tzinfo,
+        )
+        if ts > last_ts:
+            # Day rollover, this was actually yesterday.
+            ts = ts - timedelta(days=1)
+        last_ts = ts
+        # Find the chat message ID.
+        chip_elm = _xpath_one(CHIP_XPATH, elm)
+        if chip_elm is None:
+            raise ParseError(f"Unable to find chip: {content.decode()}")
+        message_id_a_elm = _xpath_one(MESSAGE_ID_A_XPATH, chip_elm)
+        if message_id_a_elm is None:
+            raise ParseError(f"Unable to find message ID link: {content.decode()}")
+        message_id_match = MESSAGE_ID_RE.match(message_id_a_elm.get("href", ""))
+        if message_id_match is None:
+            raise ParseError(
+                f"Unable to parse message ID: {message_id_a_elm.get('href')}"
+            )
+        # Then the rest of the stuff is easy.
+        emblem_elm = _xpath_one(EMBLEM_XPATH, elm)
+        if emblem_elm is None:
+            raise ParseError(f"Unable to find emblem: {content.decode()}")
+        icons_elm = _xpath_one(ICONS_XPATH, elm)
+        if icons_elm is None:
+            raise ParseError(f"Unable to find icons: {content.decode()}")
+        content_elm = html.find_next(icons_elm, "span")
+        if content_elm is None:
+            raise ParseError(f"Unable to find content span: {content.decode()}")
+        msg_content = html.decode_contents(content_elm)
+        msg_content = FORCEPATH_RE.sub("<strong>Forcepath</strong>", msg_content)
+        msg_content = AT_LINK_RE.sub(r"\1:", msg_content)
+        yield Message(
+            room=room,
+            id=message_id_match[1],
+            ts=ts.astimezone(UTC),
+            emblem=cast(str, emblem_elm.get("src")).rsplit("/", 1)[-1],
+            username=cast(str, emblem_elm.get("data-username")),
+            content=msg_content,
+            deleted="redstripes" in html.classes(elm),
+        )
+
+
+ChatParser = Callable[[str, bytes, datetime | None], Iterable[Message]]
+
+CHAT_PARSERS: dict[str, ChatParser] = {
+    "bs4": _parse_chat,
+    "lxml": _parse_chat_lxml,
+}
+
+
+def _split_chat(content: bytes) -> list[tuple[str, bytes]] | None:
+    """Split the chat HTML into the raw HTML for each message, keyed by ID.
+
+    Returns None if the content doesn't look how we expect, in which case it
+    should be parsed the slow way.
+    """
+    fragments = []
+    for fragment in CHAT_TXT_SPLIT_RE.split(content)[1:]:
+        id_match = FRAGMENT_ID_RE.search(fragment)
+        if id_match is None:
+            return None
+        fragments.append((id_match[1].decode(), fragment))
+    if not fragments or len({id for id, _ in fragments}) != len(fragments):
+        return None
+    return fragments
+
+
+def _flags_digest(parts: list[str]) -> str:
+    # Stable across processes, unlike hash().
+    return hashlib.blake2b("\0".join(parts).encode(), digest_size=8).hexdigest()
+
+
 def _parse_flags(room: str, content: bytes) -> Iterable[Message]:
     """Parse the chat HTML into models."""
     # This has a bunch of ugly casts because the type stubs for BS aren't great.
@@ -106,7 +237,8 @@ def _parse_flags(room: str, content: bytes) -> Iterable[Message]:
         flags_match = FLAGS_RE.match(after_elm.string or "")
         yield Message(
             room=room,
-            id=str(hash(tuple(parts))),
+            # A placeholder until resolve_ids finds the real one.
+            id=UNRESOLVED_ID_PREFIX + _flags_digest(parts),
             ts=ts.astimezone(UTC),
             emblem="",
             username=parts[1],
@@ -119,28 +251,116 @@ def _parse_flags(room: str, content: bytes) -> Iterable[Message]:
 class ChatScraper:
     room: str
     flags: bool = False
-    last_messages: dict[str, Message] = {}
+    # Which backend to use for parsing chat, see CHAT_PARSERS.
+    parser: Literal["bs4", "lxml"] = "lxml"
+    last_messages: dict[str, CompactMessage] = {}
+    # Hash of the raw HTML for each message in last_messages.
+    last_hashes: dict[str, bytes] = {}
+    # Hash of the whole last response.
+    last_digest: bytes | None = None
+    # For flags, sets the real message IDs in place given the room and messages.
+    resolve_ids: Callable[[str, list[Message]], Awaitable[None]] | None = None
+
+    def prime(self, msgs: Iterable[Message]) -> None:
+        """Seed last_messages with already known messages, e.g. from the database."""
+        # Flag counts come from the flags scraper, chat always sees zero.
+        self.last_messages = {
+            msg.id: attrs.evolve(CompactMessage.of(msg), flags=0)
+            for msg in msgs
+            if msg.room == self.room
+        }
+
+    def register_checkpoint(self, checkpoint: Checkpoint) -> None:
+        kind = "flags" if self.flags else "chat"
+
+        def dump() -> dict[str, Any]:
+            return {
+                "last_messages": self.last_messages,
+                "last_hashes": self.last_hashes,
+                "last_digest": self.last_digest,
+            }
+
+        def load(state: dict[str, Any]) -> None:
+            self.last_messages = state["last_messages"]
+            self.last_hashes = state["last_hashes"]
+            self.last_digest = state["last_digest"]
+
+        checkpoint.register(f"scrapers.{kind}.{self.room}", dump, load)
+
+    async def _parse_incremental(
+        self, content: bytes
+    ) -> tuple[list[Message | CompactMessage], set[str], dict[str, bytes]]:
+        """Parse chat HTML, only fully parsing messages which changed since last time.
 
-    async def run(self) -> None:
+        Returns all the messages, the IDs of the ones which were parsed, which are
+        full messages, and the new last_hashes. Anything else is the same object from
+        last_messages. Nothing on self is changed, that's up to the caller once the
+        messages have been handled.
+        """
+        parser = CHAT_PARSERS[self.parser]
+        fragments = _split_chat(content)
+        if fragments is None:
+            msgs = await executor.run_list(parser, self.room, content, None)
+            return msgs, {msg.id for msg in msgs}, {}
+
+        msgs: list[Message | CompactMessage] = []
+        hashes: dict[str, bytes] = {}
+        parsed: set[str] = set()
+        # Runs of adjacent changed messages get parsed in one go.
+        changed: list[tuple[str, bytes]] = []
+
+        async def flush() -> None:
+            if not changed:
+                return
+            last_ts = msgs[-1].ts.astimezone(SERVER_TIME) if msgs else None
+            run_content = b"".join(fragment for _, fragment in changed)
+            run_msgs = await executor.run_list(parser, self.room, run_content, last_ts)
+            if [msg.id for msg in run_msgs] != [msg_id for msg_id, _ in changed]:
+                raise ParseError("Chat fragments did not match parsed messages")
+            msgs.extend(run_msgs)
+            parsed.update(msg.id for msg in run_msgs)
+            changed.clear()
+
+        try:
+            for msg_id, fragment in fragments:
+                digest = hashlib.blake2b(fragment, digest_size=16).digest()
+                hashes[msg_id] = digest
+                last_msg = self.last_messages.get(msg_id)
+                if last_msg is not None and self.last_hashes.get(msg_id) == digest:
+                    await flush()
+                    msgs.append(last_msg)
+                else:
+                    changed.append((msg_id, fragment))
+            await flush()
+        except ParseError:
+            log.warning("Incremental chat parse failed", room=self.room, exc_info=True)
+            msgs = await executor.run_list(parser, self.room, content, None)
+            return msgs, {msg.id for msg in msgs}, {}
+        return msgs, parsed, hashes
+
+    async def run(self) -> int:
+        """Scrape the room, returning how many new or updated messages were seen."""
         log.debug("Starting scrape", room=self.room, flags=self.flags)
         if self.flags:
-            resp = await client.get(
-                "log.php",
-                params={
-                    "type": "chat",
-                    "room": self.room,
-                    "flag": "1",
-                },
-            )
+            with lane(Lane.FLAGS):
+                resp = await client.get(
+                    "log.php",
+                    params={
+                        "type": "chat",
+                        "room": self.room,
+                        "flag": "1",
+                    },
+                )
         else:
-            resp = await client.get(
-                "worker.php",
-                params={
-                    "go": "getchat",
-                    "room": self.room,
-                    "cachebuster": time.time(),
-                },
-            )
+            with lane(Lane.CHAT):
+                resp = await client.get(
+                    "worker.php",
+                    params={
+                        "go": "getchat",
+                        "room": self.room,
+                        "cachebuster": time.time(),
+                    },
+                )
         if resp.status_code != 200:
             log.error(
                 "Got an error",
@@ -148,25 +368,51 @@ class ChatScraper:
                 status_code=resp.status_code,
                 content=resp.content,
             )
-            return
+            return 0
         if resp.content == b"no access":
             log.error("Got a 'no access'", room=self.room, content=resp.content)
-            return
+            return 0
+        kind = "flags" if self.flags else "chat"
+        POLLS.inc(room=self.room, kind=kind)
+        digest = hashlib.blake2b(resp.content, digest_size=16).digest()
+        if digest == self.last_digest:
+            SKIPPED_POLLS.inc(room=self.room, kind=kind)
+            log.debug("Skipping unchanged scrape", room=self.room, flags=self.flags)
+            return 0
         # Parse the HTML.
-        parser = _parse_flags if self.flags else _parse_chat
-        msgs = list(parser(self.room, resp.content))
-        for msg in reversed(msgs):
+        if self.flags:
+            msgs = await executor.run_list(_parse_flags, self.room, resp.content)
+            if self.resolve_ids is not None:
+                await self.resolve_ids(self.room, msgs)
+            parsed = {msg.id for msg in msgs}
+            hashes: dict[str, bytes] = {}
+        else:
+            msgs, parsed, hashes = await self._parse_incremental(resp.content)
+        emitted = 0
+        for state in reversed(msgs):
+            if state.id not in parsed:
+                # Identical HTML to last time, nothing to do.
+                continue
+            msg = cast(Message, state)
             log.debug("Got message", room=self.room, flags=self.flags, msg=msg.id)
             last_msg = self.last_messages.get(msg.id)
             if last_msg is not None and last_msg.deleted_ts is not None:
                 msg.deleted_ts = last_msg.deleted_ts
-            if last_msg is None or msg != last_msg:
+            if last_msg is None or CompactMessage.of(msg) != last_msg:
                 if (
                     last_msg is not None
                     and last_msg.deleted is False
                     and msg.deleted is True
                 ):
                     msg.deleted_ts = datetime.now(tz=UTC)
-                EVENTS.emit(f"{'flags' if self.flags else 'chat'}.{self.room}", msg=msg)
-        self.last_messages = {msg.id: msg for msg in msgs}
+                await EVENTS.emit(f"{kind}.{self.room}", msg=msg)
+                emitted += 1
+        # Only once everything was emitted, so a timeout part way through means the
+        # same changes are seen again next time.
+        self.last_messages = {msg.id: CompactMessage.of(msg) for msg in msgs}
+        self.last_hashes = hashes
+        # Poll the same page again until every ID has been resolved.
+        if not any(msg.id.startswith(UNRESOLVED_ID_PREFIX) for msg in msgs):
+            self.last_digest = digest
         log.debug("Finished scrape", room=self.room, flags=self.flags)
+        return emitted
@@ -10,9 +10,11 @@ from bs4 import BeautifulSoup, Tag
 
 from farmrpg_etl.utils.cache import FixedSizeCache
 
+from ..checkpoint import Checkpoint
 from ..events import EVENTS
-from ..http import bot_client
+from ..http import Lane, bot_client, lane
 from ..models.mailbox import Mail
+from ..utils import executor
 from ..utils.datetime import SERVER_TIME, UTC, server_now
 from .errors import ParseError
 
@@ -65,11 +67,12 @@ class MessageScraper:
     id: int
 
     async def run(self) -> None:
-        resp = await bot_client.get("message.php", params={"id": str(self.id)})
+        with lane(Lane.MAILBOX):
+            resp = await bot_client.get("message.php", params={"id": str(self.id)})
         resp.raise_for_status()
-        msg = _parse_message(self.id, resp.content)
+        msg = await executor.run(_parse_message, self.id, resp.content)
         log.info("Received message", username=msg.username, subject=msg.subject)
-        EVENTS.emit("dm", msg=msg)
+        await EVENTS.emit("dm", msg=msg)
 
 
 @attrs.define
@@ -100,10 +103,20 @@ def _parse_mailbox(content: bytes) -> Iterable[MailboxRow]:
 class MailboxScraper:
     recent_messages: FixedSizeCache[int, bool] = FixedSizeCache(100)
 
+    def register_checkpoint(self, checkpoint: Checkpoint) -> None:
+        def load(state: dict[int, bool]) -> None:
+            for id, seen in state.items():
+                self.recent_messages[id] = seen
+
+        checkpoint.register(
+            "scrapers.mailbox", lambda: dict(self.recent_messages), load
+        )
+
     async def run(self) -> None:
-        resp = await bot_client.get("messages.php")
+        with lane(Lane.MAILBOX):
+            resp = await bot_client.get("messages.php")
         resp.raise_for_status()
-        for row in _parse_mailbox(resp.content):
+        for row in await executor.run_list(_parse_mailbox, resp.content):
             log.debug("Found message", id=row.id, unread=row.unread)
             if row.unread and not self.recent_messages.get(row.id):
                 log.info("Scraping message", id=row.id)
@@ -1,5 +1,7 @@
 import asyncio
+import os
 import re
+import time
 import urllib.parse
 from typing import Iterable, Literal, cast
 
@@ -8,14 +10,27 @@ import structlog
 from bs4 import BeautifulSoup, Tag
 
 from ..events import EVENTS
-from ..http import client
+from ..http import Lane, client, lane
+from ..metrics import METRICS
 from ..models.user import User, UserSnapshot
+from ..utils import executor
+from ..utils.cache import FixedSizeCache
 from ..utils.datetime import now
 from .errors import ParseError
 
 FRIENDS_LINK_RE = re.compile(r"^members.php\?type=friended&id=(\d+)$")
 ONLINE_PROFILE_RE = re.compile(r"^profile.php\?")
 
+SKIPPED_FETCHES = METRICS.counter(
+    "profile_fetches_skipped_total",
+    "Online users whose profile was fresh enough to skip fetching.",
+)
+
+DEDUPED_FETCHES = METRICS.counter(
+    "profile_fetches_deduped_total",
+    "Profile fetches skipped because one for the same user was already queued.",
+)
+
 log = structlog.stdlib.get_logger(mod="scrapers.user")
 
 
@@ -70,54 +85,193 @@ def _parse_online(content: bytes) -> Iterable[str]:
         yield qs["user_name"][0]
 
 
+@attrs.define
+class Freshness:
+    # When the profile was last fetched and when it last changed, monotonic time.
+    checked: float
+    changed: float
+    # The parts of the snapshot we care about, see _freshness_key.
+    key: tuple
+
+
+def _freshness_key(snap: UserSnapshot) -> tuple:
+    return (snap.user.id, snap.username, snap.is_farmhand, snap.is_ranger)
+
+
+@attrs.define
+class FreshnessPolicy:
+    """Decide which profiles are worth fetching again.
+
+    Each tier is (unchanged for, refresh every) in seconds and the first tier the
+    profile has been unchanged long enough for applies, so a profile which hasn't
+    changed in a week is only fetched every 6 hours. Staff are always fetched.
+    """
+
+    tiers: list[tuple[float, float]] = attrs.Factory(
+        lambda: [(7 * 86400, 6 * 3600), (86400, 3600), (3600, 1200), (0, 0)]
+    )
+    profiles: FixedSizeCache[str, Freshness] = attrs.Factory(
+        lambda: FixedSizeCache(50000, policy="lru", name="profile_freshness")
+    )
+    staff: set[str] = attrs.Factory(set)
+
+    def needs_refresh(self, username: str, now: float | None = None) -> bool:
+        entry = self.profiles.get(username)
+        if entry is None or username in self.staff:
+            return True
+        if now is None:
+            now = time.monotonic()
+        unchanged = now - entry.changed
+        for min_unchanged, ttl in self.tiers:
+            if unchanged >= min_unchanged:
+                return now - entry.checked >= ttl
+        return True
+
+    def record(
+        self, username: str, snap: UserSnapshot | None, now: float | None = None
+    ) -> None:
+        """Record a fetch of a profile, snap is None if the page was unchanged."""
+        if now is None:
+            now = time.monotonic()
+        entry = self.profiles.get(username)
+        if entry is None:
+            if snap is not None:
+                self.profiles[username] = Freshness(now, now, _freshness_key(snap))
+            return
+        entry.checked = now
+        if snap is not None:
+            key = _freshness_key(snap)
+            if key != entry.key:
+                entry.changed = now
+                entry.key = key
+
+
+freshness = FreshnessPolicy()
+
+
 @attrs.define
 class UserScraper:
     username: str
 
     # This is used when the bot receives a DM to get an up-to-date user ID.
     async def scrape(self) -> UserSnapshot:
-        resp = await client.get("profile.php", params={"user_name": self.username})
+        with lane(Lane.PROFILE):
+            resp = await client.get("profile.php", params={"user_name": self.username})
         resp.raise_for_status()
-        return _parse_profile(self.username, resp.content)
+        return await executor.run(_parse_profile, self.username, resp.content)
 
     async def run(self) -> None:
         log.debug("Starting user scrape", username=self.username)
-        snap = await self.scrape()
-        EVENTS.emit("user_snapshot", snap=snap)
+        params = {"user_name": self.username}
+        with lane(Lane.PROFILE):
+            resp, changed = await client.get_cached("profile.php", params=params)
+        resp.raise_for_status()
+        if not changed:
+            log.debug("Skipping unchanged profile", username=self.username)
+            freshness.record(self.username, None)
+            return
+        try:
+            snap = await executor.run(_parse_profile, self.username, resp.content)
+            await EVENTS.emit("user_snapshot", snap=snap)
+        except BaseException:
+            # Make sure we try again next time rather than skipping it.
+            client.invalidate("profile.php", params=params)
+            raise
+        freshness.record(self.username, snap)
         log.debug("Finished user scrape", username=self.username, user_id=snap.user.id)
 
 
+class ProfileScrapePool:
+    """Scrape profiles with a fixed number of workers.
+
+    A username which is already queued or being scraped isn't queued again, the
+    caller just waits for the existing scrape to finish.
+    """
+
+    def __init__(self, workers: int) -> None:
+        self.workers = workers
+        self.queue: asyncio.Queue[str] = asyncio.Queue()
+        # Usernames queued or being scraped, and a future for when they're done.
+        self.in_flight: dict[str, asyncio.Future[None]] = {}
+        self.tasks: list[asyncio.Task] = []
+
+    def submit(self, username: str) -> asyncio.Future[None]:
+        fut = self.in_flight.get(username)
+        if fut is not None:
+            DEDUPED_FETCHES.inc()
+            return fut
+        while len(self.tasks) < self.workers:
+            self.tasks.append(
+                asyncio.create_task(self._work(), name="profile-scrape-worker")
+            )
+        fut = self.in_flight[username] = asyncio.get_running_loop().create_future()
+        self.queue.put_nowait(username)
+        return fut
+
+    async def scrape_all(self, usernames: Iterable[str]) -> None:
+        """Scrape all the given users, returning once they are done."""
+        # Shielded so a cancelled sweep doesn't cancel scrapes other sweeps wait on.
+        await asyncio.gather(*(asyncio.shield(self.submit(u)) for u in usernames))
+
+    async def _work(self) -> None:
+        while True:
+            username = await self.queue.get()
+            try:
+                await UserScraper(username=username).run()
+            except Exception:
+                log.exception("Error scraping profile", username=username)
+            finally:
+                fut = self.in_flight.pop(username)
+                if not fut.done():
+                    fut.set_result(None)
+                self.queue.task_done()
+
+
+profile_pool = ProfileScrapePool(int(os.environ.get("PROFILE_WORKERS", "4")))
+
+
 @attrs.define
 class OnlineScraper:
+    last_online: list[str] = []
+
     async def run(self) -> None:
         log.debug("Starting online scrape")
-        resp = await client.get("online.php")
+        with lane(Lane.PROFILE):
+            resp, changed = await client.get_cached("online.php")
         resp.raise_for_status()
-        online = _parse_online(resp.content)
-        # For each online user, scrape them.
-        for username in online:
-            asyncio.create_task(
-                UserScraper(username=username).run(), name=f"user-scraper-{username}"
-            )
-            await asyncio.sleep(0.1)
-
-        log.debug("Finished online scrape")
+        if changed or not self.last_online:
+            self.last_online = await executor.run_list(_parse_online, resp.content)
+        # For each online user, scrape them if they might have changed.
+        usernames = []
+        for username in self.last_online:
+            if freshness.needs_refresh(username):
+                usernames.append(username)
+            else:
+                SKIPPED_FETCHES.inc()
+        await profile_pool.scrape_all(usernames)
+        log.debug(
+            "Finished online scrape",
+            online=len(self.last_online),
+            fetched=len(usernames),
+        )
 
 
 @attrs.define
 class StaffListScraper:
     """Make sure staff are always tracked."""
 
+    last_staff: list[str] = []
+
     async def run(self) -> None:
         log.debug("Starting staff scrape")
-        resp = await client.get("members.php", params={"type": "staff"})
+        with lane(Lane.PROFILE):
+            resp, changed = await client.get_cached(
+                "members.php", params={"type": "staff"}
+            )
         resp.raise_for_status()
-        staff = _parse_online(resp.content)
+        if changed or not self.last_staff:
+            self.last_staff = await executor.run_list(_parse_online, resp.content)
+            freshness.staff = set(self.last_staff)
         # For each staff user, scrape them.
-        for username in staff:
-            asyncio.create_task(
-                UserScraper(username=username).run(), name=f"user-scraper-{username}"
-            )
-            await asyncio.sleep(0.1)
-
+        await profile_pool.scrape_all(self.last_staff)
         log.debug("Finished staff scrape")
@@ -1,10 +1,31 @@
 import asyncio
+import math
+import random
 from asyncio import Task
-from typing import Any, Callable, Coroutine
+from typing import Any, Callable, Coroutine, Literal
 
 import attrs
 import structlog
 
+from .metrics import METRICS
+
+TASK_TIME = METRICS.histogram(
+    "task_run_seconds", "Time taken by each run of a periodic task."
+)
+TASK_OVERRUNS = METRICS.counter(
+    "task_overruns_total", "Periodic task runs which took longer than the interval."
+)
+TASK_ERRORS = METRICS.counter("task_errors_total", "Periodic task runs which failed.")
+TASK_TIMEOUTS = METRICS.counter(
+    "task_timeouts_total", "Periodic task runs cancelled for exceeding their timeout."
+)
+TASK_SKIPPED = METRICS.counter(
+    "task_skipped_ticks_total", "Fixed rate ticks skipped because a run overran."
+)
+LOOP_LAG = METRICS.histogram(
+    "event_loop_lag_seconds", "How late the event loop is to wake up a sleeping task."
+)
+
 log = structlog.stdlib.get_logger(mod="tasks")
 
 
@@ -16,22 +37,127 @@ class PeriodicTask:
     def stop(self) -> None:
         self._is_stopping[0] = True
 
-    def __getattribute__(self, name: str) -> Any:
+    def __getattr__(self, name: str) -> Any:
         return getattr(self._task, name)
 
 
+@attrs.define
+class AdaptiveInterval:
+    """An interval which adapts to how much activity each run sees.
+
+    The task coroutine returns how much activity it saw (e.g. new messages) and
+    this keeps a moving average of the activity rate, aiming for about `target`
+    activity per run. Quiet tasks back off towards max_interval and busy ones
+    tighten up towards min_interval.
+    """
+
+    min_interval: float
+    max_interval: float
+    target: float = 1
+    # Weight of the newest sample in the moving average.
+    smoothing: float = 0.3
+    # Random fraction added to or removed from each sleep.
+    jitter: float = 0.1
+    rate: float | None = None
+    interval: float = attrs.field(init=False)
+
+    def __attrs_post_init__(self) -> None:
+        self.interval = self.min_interval
+
+    def update(self, activity: int, elapsed: float | None = None) -> float:
+        """Record the result of a run and return how long to sleep."""
+        if elapsed is None or elapsed <= 0:
+            elapsed = self.interval
+        sample = activity / elapsed
+        if self.rate is None:
+            self.rate = sample
+        else:
+            self.rate = self.smoothing * sample + (1 - self.smoothing) * self.rate
+        interval = self.target / self.rate if self.rate > 0 else self.max_interval
+        self.interval = min(self.max_interval, max(self.min_interval, interval))
+        return self.interval * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+
+# What a fixed rate task does when a run takes longer than the interval.
+#   skip: wait for the next tick on the original schedule.
+#   immediate: run straight away for each missed tick until caught up.
+#   coalesce: run once straight away and restart the schedule from there.
+Overrun = Literal["skip", "immediate", "coalesce"]
+
+
 def create_periodic_task(
-    coro: Callable[[], Coroutine], interval: int | float, *, name: str | None = None
+    coro: Callable[[], Coroutine],
+    interval: int | float | AdaptiveInterval,
+    *,
+    name: str | None = None,
+    fixed_rate: bool = False,
+    overrun: Overrun = "skip",
+    timeout: float | None = None,
 ):
+    """Run coro every interval seconds.
+
+    By default the interval is the sleep between the end of one run and the start
+    of the next. With fixed_rate it is the time between the starts of runs instead,
+    with overrun deciding what happens when a run doesn't finish in time. Runs
+    taking longer than timeout seconds are cancelled.
+    """
     is_stopping = [False]
 
     async def wrapper():
+        loop = asyncio.get_running_loop()
+        last_start = None
+        next_tick = loop.time()
         while not is_stopping[0]:
+            start = loop.time()
+            activity = None
             try:
-                await coro()
+                activity = await asyncio.wait_for(coro(), timeout)
+            except asyncio.TimeoutError:
+                TASK_TIMEOUTS.inc(task=name or "")
+                log.error("Periodic task timed out", task_name=name, timeout=timeout)
             except Exception:
+                TASK_ERRORS.inc(task=name or "")
                 log.error("Error in periodic task", exc_info=True, task_name=name)
-            await asyncio.sleep(interval)
+            duration = loop.time() - start
+            TASK_TIME.observe(duration, task=name or "")
+            current = (
+                interval.interval
+                if isinstance(interval, AdaptiveInterval)
+                else interval
+            )
+            if duration > current:
+                TASK_OVERRUNS.inc(task=name or "")
+            if isinstance(interval, AdaptiveInterval):
+                elapsed = None if last_start is None else start - last_start
+                delay = interval.update(activity or 0, elapsed)
+            else:
+                delay = interval
+            last_start = start
+            if fixed_rate:
+                next_tick += delay
+                now = loop.time()
+                if now > next_tick and delay > 0:
+                    if overrun == "skip":
+                        missed = math.ceil((now - next_tick) / delay)
+                        TASK_SKIPPED.inc(missed, task=name or "")
+                        next_tick += missed * delay
+                    elif overrun == "coalesce":
+                        next_tick = now
+                delay = max(0, next_tick - now)
+            await asyncio.sleep(delay)
 
     task = asyncio.create_task(wrapper(), name=name)
     return PeriodicTask(task, is_stopping)
+
+
+def create_lag_monitor(interval: float = 1) -> Task:
+    """Sample how far behind the event loop is running."""
+
+    async def monitor():
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(interval)
+            LOOP_LAG.observe(max(0, loop.time() - start - interval))
+
+    return asyncio.create_task(monitor(), name="loop-lag-monitor")
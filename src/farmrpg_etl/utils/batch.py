@@ -0,0 +1,114 @@
+import asyncio
+import time
+import typing
+
+import structlog
+
+from ..metrics import METRICS
+
+_T = typing.TypeVar("_T")
+
+BATCH_SIZE = METRICS.histogram(
+    "batch_size",
+    "Number of items written per batch.",
+    buckets=(1, 5, 10, 25, 50, 100, 250, 500, 1000),
+)
+BATCH_TIME = METRICS.histogram("batch_seconds", "Time to write each batch.")
+BATCH_ERRORS = METRICS.counter("batch_errors_total", "Failed batch write attempts.")
+
+log = structlog.stdlib.get_logger(mod="utils.batch")
+
+
+class BatchWriter(typing.Generic[_T]):
+    """Collect items and write them in batches.
+
+    A batch is written once max_size items are waiting or after max_delay
+    seconds, whichever is first. If max_pending items are waiting then add()
+    blocks until the writer catches up. Failed writes are retried up to
+    max_retries times with exponential backoff before the batch is dropped.
+    """
+
+    # Every writer, so they can all be flushed on shutdown.
+    writers: "list[BatchWriter]" = []
+
+    def __init__(
+        self,
+        name: str,
+        write: typing.Callable[[list[_T]], typing.Awaitable[None]],
+        *,
+        max_size: int = 500,
+        max_delay: float = 0.5,
+        max_pending: int = 5000,
+        max_retries: int = 0,
+        retry_delay: float = 0.5,
+    ) -> None:
+        self.name = name
+        self.write = write
+        self.max_size = max_size
+        self.max_delay = max_delay
+        self.max_pending = max_pending
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.pending: list[_T] = []
+        self._task: asyncio.Task | None = None
+        self._full = asyncio.Event()
+        self._flushed = asyncio.Event()
+        self._lock = asyncio.Lock()
+        self.writers.append(self)
+
+    async def add(self, item: _T) -> None:
+        while len(self.pending) >= self.max_pending:
+            await self._flushed.wait()
+        self.pending.append(item)
+        if len(self.pending) >= self.max_size:
+            self._full.set()
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(
+                self._run(), name=f"batch-writer-{self.name}"
+            )
+
+    async def _run(self) -> None:
+        while self.pending:
+            try:
+                await asyncio.wait_for(self._full.wait(), self.max_delay)
+            except asyncio.TimeoutError:
+                pass
+            await self.flush()
+
+    async def flush(self) -> None:
+        """Write everything pending right now."""
+        async with self._lock:
+            self._full.clear()
+            while self.pending:
+                batch = self.pending[: self.max_size]
+                del self.pending[: self.max_size]
+                BATCH_SIZE.observe(len(batch), name=self.name)
+                await self._write(batch)
+                # Wake up anything waiting on backpressure.
+                self._flushed.set()
+                self._flushed.clear()
+
+    async def _write(self, batch: list[_T]) -> None:
+        for attempt in range(self.max_retries + 1):
+            start = time.perf_counter()
+            try:
+                await self.write(batch)
+            except Exception:
+                BATCH_ERRORS.inc(name=self.name)
+                if attempt == self.max_retries:
+                    log.exception(
+                        "Error writing batch", name=self.name, size=len(batch)
+                    )
+                    return
+                log.warning(
+                    "Retrying batch", name=self.name, attempt=attempt, exc_info=True
+                )
+                await asyncio.sleep(self.retry_delay * 2**attempt)
+            else:
+                BATCH_TIME.observe(time.perf_counter() - start, name=self.name)
+                return
+
+    @classmethod
+    async def flush_all(cls) -> None:
+        for writer in cls.writers:
+            await writer.flush()
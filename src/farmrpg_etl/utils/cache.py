@@ -1,16 +1,207 @@
+import sys
+import time
 import typing
+from collections import OrderedDict
+
+from ..metrics import METRICS
 
 _K = typing.TypeVar("_K")
 _V = typing.TypeVar("_V")
 
+CACHE_REQUESTS = METRICS.counter(
+    "cache_requests_total", "Cache lookups, by whether they were a hit or a miss."
+)
+CACHE_EVICTIONS = METRICS.counter(
+    "cache_evictions_total", "Entries removed from caches to stay in bounds."
+)
+
+Policy = typing.Literal["fifo", "lru"]
+
+_MISSING: typing.Any = object()
+_FOREVER = float("inf")
+
+
+class FixedSizeCache(typing.Generic[_K, _V], OrderedDict[_K, _V]):
+    """A dict which throws away old entries to stay under a size limit.
+
+    Entries are evicted in insertion order ("fifo") or least recently used first
+    ("lru"). The limit is a count of entries and/or a total of sizeof(value) over
+    all entries. With a ttl, entries also expire that many seconds after they were
+    set, though they are only removed when next looked at, so len() and iterating
+    over the keys, values or items can include expired entries.
+
+    If given a name, hits and misses are counted and exported as metrics along
+    with evictions. A FIFO cache with no ttl or name has nothing to do on lookup,
+    so it uses the plain dict lookups.
+    """
 
-class FixedSizeCache(typing.Generic[_K, _V], dict[_K, _V]):
-    def __init__(self, max_size: int):
+    def __init__(
+        self,
+        max_size: int | None = None,
+        *,
+        policy: Policy = "fifo",
+        ttl: float | None = None,
+        max_bytes: int | None = None,
+        sizeof: typing.Callable[[_V], int] = sys.getsizeof,
+        name: str | None = None,
+    ):
         super().__init__()
         self.__max_size = max_size
+        self.policy = policy
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.name = name
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.bytes = 0
+        self._sizes: dict[_K, int] = {}
+        self._expires: dict[_K, float] = {}
+        if type(self) is FixedSizeCache and _PlainCache.suitable(self):
+            self.__class__ = _PlainCache
+
+    @property
+    def max_size(self) -> int | None:
+        return self.__max_size
+
+    def __reduce__(self) -> tuple:
+        # Rebuild through __init__ so copies get their own bookkeeping and class.
+        config = {
+            "max_size": self.__max_size,
+            "policy": self.policy,
+            "ttl": self.ttl,
+            "max_bytes": self.max_bytes,
+            "sizeof": self.sizeof,
+            "name": self.name,
+        }
+        return (_restore, (config, list(OrderedDict.items(self)), dict(self._expires)))
+
+    def _record(self, hit: bool) -> None:
+        if self.name is None:
+            return
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+        CACHE_REQUESTS.inc(cache=self.name, result="hit" if hit else "miss")
+
+    def _evict(self, key: _K, reason: str) -> None:
+        self._remove(key)
+        self.evictions += 1
+        if self.name is not None:
+            CACHE_EVICTIONS.inc(cache=self.name, reason=reason)
+
+    def _remove(self, key: _K) -> _V:
+        if self._sizes:
+            self.bytes -= self._sizes.pop(key, 0)
+        if self._expires:
+            self._expires.pop(key, None)
+        # Explicitly the OrderedDict methods, so none of ours are called back.
+        value = OrderedDict.__getitem__(self, key)
+        OrderedDict.__delitem__(self, key)
+        return value
+
+    def _expired(self, key: _K) -> bool:
+        """Check if a key has expired, removing it if so."""
+        if self.ttl is None or self._expires.get(key, _FOREVER) > time.monotonic():
+            return False
+        self._evict(key, "ttl")
+        return True
+
+    def get(self, key: _K, default: typing.Any = None) -> typing.Any:
+        value = OrderedDict.get(self, key, _MISSING)
+        if value is _MISSING or (self.ttl is not None and self._expired(key)):
+            self._record(False)
+            return default
+        self._record(True)
+        if self.policy == "lru":
+            self.move_to_end(key)
+        return value
+
+    def __getitem__(self, key: _K) -> _V:
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key: object) -> bool:
+        return OrderedDict.__contains__(self, key) and not self._expired(
+            typing.cast(_K, key)
+        )
 
     def __setitem__(self, key: _K, value: _V) -> None:
-        super().__setitem__(key, value)
-        if len(self) > self.__max_size:
-            oldest_key = next(iter(self.keys()))
-            del self[oldest_key]
+        if OrderedDict.__contains__(self, key):
+            if self._sizes:
+                self.bytes -= self._sizes.pop(key, 0)
+            if self.policy == "lru":
+                self.move_to_end(key)
+        OrderedDict.__setitem__(self, key, value)
+        if self.max_bytes is not None:
+            size = self._sizes[key] = self.sizeof(value)
+            self.bytes += size
+        if self.ttl is not None:
+            self._expires[key] = time.monotonic() + self.ttl
+        max_size = self.__max_size
+        if max_size is not None:
+            while len(self) > max_size:
+                # The front of the linked list, so O(1) unlike a plain dict.
+                self._evict(next(iter(self)), "size")
+        if self.max_bytes is not None:
+            while self.bytes > self.max_bytes and self:
+                self._evict(next(iter(self)), "bytes")
+
+    def __delitem__(self, key: _K) -> None:
+        self._remove(key)
+
+    def pop(self, key: _K, *default: typing.Any) -> typing.Any:
+        if not OrderedDict.__contains__(self, key) or self._expired(key):
+            if default:
+                return default[0]
+            raise KeyError(key)
+        return self._remove(key)
+
+    def popitem(self, last: bool = True) -> tuple[_K, _V]:
+        if not self:
+            raise KeyError("popitem(): cache is empty")
+        key = next(reversed(self)) if last else next(iter(self))
+        return key, self._remove(key)
+
+    def clear(self) -> None:
+        OrderedDict.clear(self)
+        self._sizes.clear()
+        self._expires.clear()
+        self.bytes = 0
+
+    def update(self, *args: typing.Any, **kwargs: _V) -> None:
+        for key, value in dict(*args, **kwargs).items():
+            self[key] = value
+
+    def setdefault(self, key: _K, default: _V) -> _V:  # type: ignore[override]
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+
+class _PlainCache(FixedSizeCache[_K, _V]):
+    """A FIFO cache with no ttl or stats, which only has to act on insert."""
+
+    get = OrderedDict.get  # type: ignore[assignment]
+    __getitem__ = OrderedDict.__getitem__  # type: ignore[assignment]
+    __contains__ = OrderedDict.__contains__  # type: ignore[assignment]
+
+    @staticmethod
+    def suitable(cache: FixedSizeCache) -> bool:
+        return cache.policy == "fifo" and cache.ttl is None and cache.name is None
+
+
+def _restore(
+    config: dict[str, typing.Any],
+    items: list[tuple[typing.Any, typing.Any]],
+    expires: dict[typing.Any, float],
+) -> FixedSizeCache:
+    cache: FixedSizeCache = FixedSizeCache(**config)
+    for key, value in items:
+        cache[key] = value
+    cache._expires.update(expires)
+    return cache
@@ -0,0 +1,77 @@
+"""Run HTML parsing off the event loop.
+
+Set PARSE_EXECUTOR to "process" to parse in a pool of PARSE_WORKERS processes,
+or "thread" for a thread pool. Anything else parses inline on the event loop.
+Parse functions and their arguments and results must be picklable, so they
+have to be module level functions and generators must be collected into lists.
+"""
+
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Iterable, TypeVar
+
+import structlog
+
+_T = TypeVar("_T")
+
+log = structlog.stdlib.get_logger(mod="utils.executor")
+
+
+def _workers() -> int:
+    return int(os.environ.get("PARSE_WORKERS", str(os.cpu_count() or 1)))
+
+
+def _thread_pool() -> Executor:
+    return ThreadPoolExecutor(_workers(), thread_name_prefix="parse")
+
+
+def _create() -> Executor | None:
+    kind = os.environ.get("PARSE_EXECUTOR")
+    if kind == "process":
+        try:
+            # Not fork, the child doesn't need a copy of the event loop and clients.
+            return ProcessPoolExecutor(
+                _workers(), mp_context=multiprocessing.get_context("spawn")
+            )
+        except (ImportError, NotImplementedError, OSError):
+            log.warning("Unable to start parse processes, using threads", exc_info=True)
+            return _thread_pool()
+    if kind == "thread":
+        return _thread_pool()
+    return None
+
+
+executor = _create()
+
+
+def _collect(fn: Callable[..., Iterable[_T]], *args) -> list[_T]:
+    return list(fn(*args))
+
+
+async def run(fn: Callable[..., _T], *args) -> _T:
+    """Call fn(*args) in the parse executor."""
+    global executor
+    if executor is None:
+        return fn(*args)
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(executor, fn, *args)
+    except BrokenProcessPool:
+        # A worker died (OOM killer?), carry on with threads rather than crashing.
+        log.error("Parse process pool broke, switching to threads", exc_info=True)
+        if isinstance(executor, ProcessPoolExecutor):
+            executor = _thread_pool()
+        return await loop.run_in_executor(executor, fn, *args)
+
+
+async def run_list(fn: Callable[..., Iterable[_T]], *args) -> list[_T]:
+    """Like run() but for generators, returning the items as a list."""
+    return await run(_collect, fn, *args)
+
+
+def shutdown() -> None:
+    if executor is not None:
+        executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,111 @@
+"""Helpers for working with raw lxml trees.
+
+BeautifulSoup is nice to work with but building its tree is slow, so hot paths
+parse with lxml directly. These helpers reproduce the bits of BeautifulSoup's
+behavior we depend on (notably `decode_contents(formatter="html5")`) so the
+output is identical either way.
+"""
+
+import re
+
+from bs4.builder import HTMLTreeBuilder
+from bs4.dammit import EntitySubstitution
+from lxml import etree
+
+NONWHITESPACE_RE = re.compile(r"\S+")
+
+# Same tables BeautifulSoup uses when rendering HTML.
+VOID_ELEMENTS = HTMLTreeBuilder.empty_element_tags
+LIST_ATTRIBUTES = HTMLTreeBuilder.DEFAULT_CDATA_LIST_ATTRIBUTES
+CDATA_TAGS = {"script", "style"}
+
+_quote = EntitySubstitution.quoted_attribute_value
+
+
+def _substitute(s: str) -> str:
+    if s.isascii():
+        # Fast path, the only ASCII characters with entities are these three.
+        return s.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+    return EntitySubstitution.substitute_html(s)
+
+
+def has_class(name: str) -> str:
+    """XPath predicate matching a CSS class, like `.name` in a selector."""
+    return f"contains(concat(' ', normalize-space(@class), ' '), ' {name} ')"
+
+
+def parse(content: bytes) -> etree._Element | None:
+    """Parse an HTML document. Returns None for an empty document."""
+    # Always a fresh parser, they aren't safe to share between threads.
+    return etree.fromstring(content, etree.HTMLParser(encoding="utf-8"))
+
+
+def classes(elm: etree._Element) -> list[str]:
+    return NONWHITESPACE_RE.findall(elm.get("class") or "")
+
+
+def text(elm: etree._Element) -> str:
+    """Equivalent of BeautifulSoup's `Tag.text`."""
+    return "".join(elm.itertext())
+
+
+def find_next(elm: etree._Element, tag: str) -> etree._Element | None:
+    """Equivalent of BeautifulSoup's `Tag.find_next(tag)`.
+
+    This is the same as the XPath `(descendant::tag | following::tag)[1]` but
+    doesn't have to scan the whole rest of the document.
+    """
+    found = next(elm.iterdescendants(tag), None)
+    while found is None and elm is not None:
+        for sibling in elm.itersiblings():
+            if sibling.tag == tag:
+                return sibling
+            found = next(sibling.iterdescendants(tag), None)
+            if found is not None:
+                break
+        elm = elm.getparent()
+    return found
+
+
+def decode_contents(elm: etree._Element) -> str:
+    """Equivalent of BeautifulSoup's `Tag.decode_contents(formatter="html5")`."""
+    out: list[str] = []
+    _decode_contents(elm, out)
+    return "".join(out)
+
+
+def _decode_contents(elm: etree._Element, out: list[str]) -> None:
+    cdata = elm.tag in CDATA_TAGS
+    if elm.text:
+        out.append(elm.text if cdata else _substitute(elm.text))
+    for child in elm:
+        _decode(child, out)
+        if child.tail:
+            out.append(child.tail if cdata else _substitute(child.tail))
+
+
+def _decode(elm: etree._Element, out: list[str]) -> None:
+    if elm.tag is etree.Comment:
+        out.append(f"<!--{elm.text or ''}-->")
+        return
+    if elm.tag is etree.ProcessingInstruction:
+        out.append(f"<?{elm.text or ''}>")
+        return
+    tag = elm.tag
+    list_attrs = LIST_ATTRIBUTES.get("*", []) + LIST_ATTRIBUTES.get(tag, [])
+    attrs = []
+    # BeautifulSoup always sorts attributes by name.
+    for key, value in sorted(elm.items()):
+        if key in list_attrs:
+            value = " ".join(NONWHITESPACE_RE.findall(value))
+        elif value == "":
+            # Rendered as a boolean attribute.
+            attrs.append(key)
+            continue
+        attrs.append(f"{key}={_quote(_substitute(value))}")
+    attrs_str = "".join(f" {a}" for a in attrs)
+    out.append(f"<{tag}{attrs_str}>")
+    if tag in VOID_ELEMENTS and elm.text is None and len(elm) == 0:
+        return
+    _decode_contents(elm, out)
+    out.append(f"</{tag}>")
@@ -0,0 +1,80 @@
+import asyncio
+import contextlib
+import heapq
+import itertools
+import time
+from typing import AsyncIterator
+
+
+class PriorityRateLimiter:
+    """A token bucket rate limiter with a cap on concurrent holders.
+
+    Waiters are let through strictly in priority order (lowest first) and FIFO
+    within a priority, so a backlog of low priority work can't delay anything
+    more important by more than one slot.
+    """
+
+    def __init__(self, rate: float, burst: float, concurrency: int) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.concurrency = concurrency
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._in_flight = 0
+        self._waiters: list[tuple[int, int]] = []
+        self._counter = itertools.count()
+        self._cond = asyncio.Condition()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    async def acquire(self, priority: int = 0) -> None:
+        entry = (priority, next(self._counter))
+        async with self._cond:
+            heapq.heappush(self._waiters, entry)
+            try:
+                while True:
+                    self._refill()
+                    timeout = None
+                    if self._waiters[0] == entry and self._in_flight < self.concurrency:
+                        if self._tokens >= 1:
+                            break
+                        # Sleep until the next token should be available.
+                        timeout = (1 - self._tokens) / self.rate
+                    try:
+                        await asyncio.wait_for(self._cond.wait(), timeout)
+                    except asyncio.TimeoutError:
+                        pass
+            except BaseException:
+                self._waiters.remove(entry)
+                heapq.heapify(self._waiters)
+                self._cond.notify_all()
+                raise
+            heapq.heappop(self._waiters)
+            self._tokens -= 1
+            self._in_flight += 1
+            # Let the next waiter check if it can go too.
+            self._cond.notify_all()
+
+    async def release(self) -> None:
+        self._in_flight -= 1
+        async with self._cond:
+            self._cond.notify_all()
+
+    @contextlib.asynccontextmanager
+    async def limit(self, priority: int = 0) -> AsyncIterator[None]:
+        await self.acquire(priority)
+        try:
+            yield
+        finally:
+            await self.release()
@@ -0,0 +1,39 @@
+import pickle
+import tempfile
+import typing
+
+_T = typing.TypeVar("_T")
+
+
+class SpillQueue(typing.Generic[_T]):
+    """A FIFO queue kept in a temporary file rather than memory.
+
+    Items must be picklable. The file is truncated whenever the queue empties
+    so it only grows while there is a backlog.
+    """
+
+    def __init__(self) -> None:
+        self._file = tempfile.TemporaryFile()
+        self._read_pos = 0
+        self._len = 0
+
+    def __len__(self) -> int:
+        return self._len
+
+    def append(self, item: _T) -> None:
+        self._file.seek(0, 2)
+        pickle.dump(item, self._file)
+        self._len += 1
+
+    def popleft(self) -> _T:
+        if not self._len:
+            raise IndexError("pop from an empty SpillQueue")
+        self._file.seek(self._read_pos)
+        item = pickle.load(self._file)
+        self._read_pos = self._file.tell()
+        self._len -= 1
+        if not self._len:
+            self._file.seek(0)
+            self._file.truncate()
+            self._read_pos = 0
+        return item
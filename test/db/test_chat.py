@@ -0,0 +1,120 @@
+import asyncio
+from datetime import datetime, timezone
+
+import attrs
+import pytest
+import pytest_asyncio
+
+from farmrpg_etl.db import chat, objects
+from farmrpg_etl.db.chat import (
+    MessageIDResolver,
+    _write_flags,
+    _write_messages,
+    flags_writer,
+    last_flags,
+    load_recent_messages,
+)
+from farmrpg_etl.models.chat import Message
+
+
+@pytest_asyncio.fixture(autouse=True)
+async def database():
+    from farmrpg_etl.db.core.conn import database
+
+    await database.connect()
+    yield database
+    await database.disconnect()
+
+
+def _message(id: str, content: str = "hello") -> Message:
+    return Message(
+        room="help",
+        id=id,
+        ts=datetime(2022, 4, 17, 1, 2, 3, tzinfo=timezone.utc),
+        emblem="def.png",
+        username="coderanger",
+        content=content,
+    )
+
+
+@pytest.mark.asyncio
+async def test_write_messages():
+    await _write_messages([_message("1"), _message("2"), _message("1")])
+    await _write_messages([_message("2", "changed"), _message("3")])
+    msgs = await objects(Message).order_by("id").all()
+    assert [msg.id for msg in msgs] == ["1", "2", "3"]
+    assert msgs[1].content == "hello"
+
+
+@pytest.mark.asyncio
+async def test_write_flags():
+    await _write_messages([_message("1"), _message("2")])
+    msg = _message("unused")
+    msg.flags = 3
+    await _write_flags([msg])
+    msgs = await objects(Message).order_by("id").all()
+    assert [msg.flags for msg in msgs] == [3, 3]
+    assert last_flags[(msg.room, msg.username, msg.ts)] == 3
+
+
+@pytest.mark.asyncio
+async def test_write_flags_before_message(monkeypatch):
+    monkeypatch.setattr(chat, "FLAG_RETRY_DELAY", 0)
+    msg = _message("1")
+    msg.flags = 2
+    await _write_flags([msg])
+    # Nothing to update yet, so it must not be remembered as written.
+    assert (msg.room, msg.username, msg.ts) not in last_flags
+
+    await _write_messages([_message("1")])
+    await asyncio.gather(*chat._retry_tasks)
+    await flags_writer.flush()
+    msgs = await objects(Message).all()
+    assert [msg.flags for msg in msgs] == [2]
+    assert last_flags[(msg.room, msg.username, msg.ts)] == 2
+
+
+@pytest.mark.asyncio
+async def test_write_messages_deleted():
+    await _write_messages([_message("1"), _message("2")])
+    deleted = _message("1")
+    deleted.deleted = True
+    deleted.deleted_ts = datetime(2022, 4, 17, 1, 5, tzinfo=timezone.utc)
+    await _write_messages([deleted, _message("2")])
+    msgs = await objects(Message).order_by("id").all()
+    assert [msg.deleted for msg in msgs] == [True, False]
+    assert msgs[0].deleted_ts == deleted.deleted_ts
+
+
+@pytest.mark.asyncio
+async def test_load_recent_messages():
+    msgs = [_message(str(i)) for i in range(5)]
+    for i, msg in enumerate(msgs):
+        msg.ts = msg.ts.replace(minute=i)
+    msgs[4].flags = 2
+    other = _message("other")
+    other.room = "global"
+    await _write_messages([*msgs, other])
+    await _write_flags([msgs[4]])
+    last_flags.clear()
+
+    recent = await load_recent_messages(["help", "global", "trade"], 3)
+    assert sorted(msg.id for msg in recent) == ["2", "3", "4", "other"]
+    assert last_flags[(msgs[4].room, msgs[4].username, msgs[4].ts)] == 2
+
+
+@pytest.mark.asyncio
+async def test_message_id_resolver():
+    resolver = MessageIDResolver()
+    seen = _message("1")
+    resolver.add(seen)
+    stored = _message("2")
+    stored.username = "other"
+    await _write_messages([stored])
+
+    flags = [attrs.evolve(msg, id="unresolved:x") for msg in [seen, stored]]
+    missing = attrs.evolve(seen, id="unresolved:y", username="nobody")
+    await resolver.resolve("help", [*flags, missing])
+    assert [msg.id for msg in flags] == ["1", "2"]
+    assert missing.id == "unresolved:y"
+    assert (missing.room, missing.username, missing.ts) in resolver.missing
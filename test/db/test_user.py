@@ -0,0 +1,59 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+import pytest_asyncio
+
+from farmrpg_etl.db import objects
+from farmrpg_etl.db.user import latest_snaps, on_snap, on_startup, snap_writer
+from farmrpg_etl.models.user import User, UserSnapshot
+
+TS = datetime(2022, 4, 17, 1, 2, 3, tzinfo=timezone.utc)
+
+
+@pytest_asyncio.fixture(autouse=True)
+async def database():
+    from farmrpg_etl.db.core.conn import database
+
+    latest_snaps.clear()
+    await database.connect()
+    yield database
+    await database.disconnect()
+
+
+def _snap(user_id: int, ts: datetime = TS, **kwargs) -> UserSnapshot:
+    return UserSnapshot(user=User(id=user_id), ts=ts, username="test", **kwargs)
+
+
+@pytest.mark.asyncio
+async def test_on_snap_skips_noop():
+    await on_snap(_snap(1))
+    await on_snap(_snap(1, TS + timedelta(minutes=10)))
+    await snap_writer.flush()
+    assert len(await objects(UserSnapshot).all()) == 1
+    await on_snap(_snap(1, TS + timedelta(minutes=20), is_ranger=True))
+    await snap_writer.flush()
+    assert len(await objects(UserSnapshot).all()) == 2
+    assert latest_snaps[1].is_ranger
+
+
+@pytest.mark.asyncio
+async def test_on_startup_warms_cache():
+    await on_snap(_snap(1))
+    await on_snap(_snap(1, TS + timedelta(minutes=10), is_ranger=True))
+    await on_snap(_snap(2))
+    await snap_writer.flush()
+    latest_snaps.clear()
+    await on_startup()
+    assert sorted(latest_snaps) == [1, 2]
+    assert latest_snaps[1].is_ranger
+
+
+@pytest.mark.asyncio
+async def test_write_snaps_bulk():
+    await objects(User).create(id=1, firebase_uid="uid1")
+    for user_id in range(1, 4):
+        await on_snap(_snap(user_id))
+    await snap_writer.flush()
+    snaps = await objects(UserSnapshot).select_related("user").all()
+    assert sorted(snap.user.id for snap in snaps) == [1, 2, 3]
+    assert len(await objects(User).all()) == 3
@@ -1,6 +1,6 @@
 import pytest
 
-from farmrpg_etl.firestore.chat import MENTION_RE
+from farmrpg_etl.firestore.chat import MENTION_RE, SetOp, _coalesce, rooms_col
 
 
 @pytest.mark.parametrize(
@@ -21,3 +21,19 @@ from farmrpg_etl.firestore.chat import MENTION_RE
 )
 def test_mentions(content, mentions):
     assert MENTION_RE.findall(content) == mentions
+
+
+def test_coalesce():
+    room = rooms_col.document("help")
+    chat = room.collection("chats").document("1")
+    ops = _coalesce(
+        [
+            SetOp(room, {"id": "help"}),
+            SetOp(chat, {"content": "hi", "deleted": False}, merge=True),
+            SetOp(chat, {"deleted": True}, merge=True),
+        ]
+    )
+    assert [(op.ref.path, op.data, op.merge) for op in ops] == [
+        ("rooms/help", {"id": "help"}, False),
+        ("rooms/help/chats/1", {"content": "hi", "deleted": True}, True),
+    ]
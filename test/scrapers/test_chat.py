@@ -1,10 +1,28 @@
+import asyncio
+import sys
 from datetime import datetime
+from pathlib import Path
 from zoneinfo import ZoneInfo
 
+import attrs
+import httpx
 import pytest
 from freezegun import freeze_time
 
-from farmrpg_etl.scrapers.chat import _parse_chat, _parse_flags
+from farmrpg_etl.models.chat import UNRESOLVED_ID_PREFIX, CompactMessage, Message
+from farmrpg_etl.scrapers import chat
+from farmrpg_etl.scrapers.chat import (
+    SKIPPED_POLLS,
+    ChatScraper,
+    _parse_chat,
+    _parse_chat_lxml,
+    _parse_flags,
+    _split_chat,
+)
+
+ALL_FIXTURES = sorted(
+    p.stem for p in (Path(__file__).parent / "fixtures").glob("*.html")
+)
 
 
 @pytest.fixture
@@ -166,6 +184,9 @@ def test_parse_chat_day_rollover(chat_day_rollover):
 def test_parse_flags(flags):
     chats = list(_parse_flags("", flags))
     assert len(chats) == 59
+    # Real IDs are filled in later by ChatScraper.resolve_ids.
+    assert chats[0].id.startswith(UNRESOLVED_ID_PREFIX)
+    assert chats[0].id == list(_parse_flags("", flags))[0].id
 
     assert chats[0].ts == datetime(2022, 4, 17, 1, 25, 32, tzinfo=ZoneInfo(key="UTC"))
     assert chats[0].username == "k-swag"
@@ -180,3 +201,177 @@ def test_parse_flags(flags):
     assert chats[1].username == "Katiepie"
     assert chats[1].content == "Plz have straw"
     assert chats[1].flags == 1
+
+
+@freeze_time("2022-04-17 23:59:59")
+@pytest.mark.parametrize("fixture", ALL_FIXTURES)
+def test_parse_chat_lxml_equivalent(load_fixture, fixture):
+    content = load_fixture(fixture)
+    assert list(_parse_chat_lxml("help", content)) == list(_parse_chat("help", content))
+
+
+def test_split_chat(help_chat):
+    fragments = _split_chat(help_chat)
+    assert fragments is not None
+    assert len(fragments) == 100
+    assert fragments[0][0] == "5364278"
+    assert fragments[0][1].startswith(b'<div class="chat-txt')
+
+
+def test_split_chat_unknown():
+    assert _split_chat(b"no access") is None
+
+
+@freeze_time("2022-04-17 23:59:59")
+@pytest.mark.asyncio
+async def test_parse_incremental(help_chat):
+    scraper = ChatScraper("help")
+    msgs, parsed, hashes = await scraper._parse_incremental(help_chat)
+    assert len(msgs) == 100
+    assert len(parsed) == 100
+    assert scraper.last_hashes == {}
+    scraper.last_messages = {msg.id: CompactMessage.of(msg) for msg in msgs}
+    scraper.last_hashes = hashes
+
+    # Nothing changed so nothing should be parsed.
+    msgs2, parsed2, _ = await scraper._parse_incremental(help_chat)
+    assert parsed2 == set()
+    assert msgs2 == [CompactMessage.of(msg) for msg in msgs]
+
+    # Delete a message in the middle.
+    deleted_chat = help_chat.replace(
+        b'<div class="chat-txt  " ><span style="color:gray">08:24:00 PM',
+        b'<div class="chat-txt  redstripes" ><span style="color:gray">08:24:00 PM',
+    )
+    assert deleted_chat != help_chat
+    msgs3, parsed3, _ = await scraper._parse_incremental(deleted_chat)
+    assert len(parsed3) == 1
+    assert [CompactMessage.of(msg) for msg in msgs3] == [
+        CompactMessage.of(msg) for msg in _parse_chat("help", deleted_chat)
+    ]
+    assert [msg.id for msg in msgs3 if msg.deleted] == list(parsed3)
+
+
+@pytest.mark.asyncio
+async def test_run_skips_unchanged(help_chat, monkeypatch):
+    async def fake_get(*args, **kwargs):
+        return httpx.Response(200, content=help_chat)
+
+    monkeypatch.setattr(chat.client, "get", fake_get)
+    scraper = ChatScraper("test-skip")
+    await scraper.run()
+    assert len(scraper.last_messages) == 100
+    assert SKIPPED_POLLS.get(room="test-skip", kind="chat") == 0
+    await scraper.run()
+    assert SKIPPED_POLLS.get(room="test-skip", kind="chat") == 1
+
+
+@freeze_time("2022-04-17 23:59:59")
+@pytest.mark.asyncio
+async def test_run_cancelled_during_emit(help_chat, monkeypatch):
+    deleted_chat = help_chat.replace(
+        b'<div class="chat-txt  " ><span style="color:gray">08:24:00 PM',
+        b'<div class="chat-txt  redstripes" ><span style="color:gray">08:24:00 PM',
+    )
+    content = help_chat
+
+    async def fake_get(*args, **kwargs):
+        return httpx.Response(200, content=content)
+
+    emitted: list[Message] = []
+    stall = asyncio.Event()
+    stalled = asyncio.Event()
+
+    async def fake_emit(key: str, msg: Message) -> None:
+        if stall.is_set():
+            stalled.set()
+            await asyncio.Event().wait()
+        emitted.append(msg)
+
+    monkeypatch.setattr(chat.client, "get", fake_get)
+    monkeypatch.setattr(chat.EVENTS, "emit", fake_emit)
+    scraper = ChatScraper("test-cancel")
+    await scraper.run()
+
+    # A sink is stuck and the scrape times out while emitting the deletion.
+    content = deleted_chat
+    stall.set()
+    task = asyncio.create_task(scraper.run())
+    await stalled.wait()
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+
+    stall.clear()
+    emitted.clear()
+    await scraper.run()
+    assert [msg.deleted for msg in emitted] == [True]
+
+
+@pytest.mark.asyncio
+async def test_run_retries_unresolved(flags, monkeypatch):
+    async def fake_get(*args, **kwargs):
+        return httpx.Response(200, content=flags)
+
+    resolved = False
+
+    async def resolve_ids(room: str, msgs: list[Message]) -> None:
+        if resolved:
+            for i, msg in enumerate(msgs):
+                msg.id = str(i)
+
+    monkeypatch.setattr(chat.client, "get", fake_get)
+    emitted: list[Message] = []
+
+    async def fake_emit(key: str, msg: Message) -> None:
+        emitted.append(msg)
+
+    monkeypatch.setattr(chat.EVENTS, "emit", fake_emit)
+    scraper = ChatScraper("test-unresolved", flags=True, resolve_ids=resolve_ids)
+    await scraper.run()
+    assert scraper.last_digest is None
+    emitted.clear()
+
+    # Same page, but this time the IDs resolve.
+    resolved = True
+    await scraper.run()
+    assert SKIPPED_POLLS.get(room="test-unresolved", kind="flags") == 0
+    assert emitted and all(msg.id.isdigit() for msg in emitted)
+    assert scraper.last_digest is not None
+
+
+@freeze_time("2022-04-17 23:59:59")
+@pytest.mark.asyncio
+async def test_prime(help_chat):
+    msgs = list(_parse_chat("help", help_chat))
+    # As loaded from the database, with flags and other rooms mixed in.
+    msgs[0].flags = 3
+    other = attrs.evolve(msgs[1], room="global", id="other")
+    scraper = ChatScraper("help")
+    scraper.prime([*msgs, other])
+    assert len(scraper.last_messages) == 100
+    assert scraper.last_messages[msgs[0].id].flags == 0
+
+    # Nothing changed so nothing is new.
+    parsed_msgs, parsed, _ = await scraper._parse_incremental(help_chat)
+    assert all(
+        CompactMessage.of(msg) == scraper.last_messages[msg.id] for msg in parsed_msgs
+    )
+
+
+def test_compact_message():
+    msg = Message(
+        room="help",
+        id="1",
+        ts=datetime(2022, 4, 17, 1, 2, 3, tzinfo=ZoneInfo("UTC")),
+        emblem="def.png",
+        username="".join(["code", "ranger"]),
+        content="hello",
+    )
+    compact = CompactMessage.of(msg)
+    assert compact.username is sys.intern("coderanger")
+    assert not hasattr(compact, "__dict__")
+    assert CompactMessage.of(compact) is compact
+    assert CompactMessage.of(attrs.evolve(msg)) == compact
+    assert CompactMessage.of(attrs.evolve(msg, content="edited")) != compact
+    assert CompactMessage.of(attrs.evolve(msg, deleted=True)) != compact
@@ -1,10 +1,21 @@
+import asyncio
 from datetime import datetime
 from zoneinfo import ZoneInfo
 
+import httpx
 import pytest
 from freezegun import freeze_time
 
-from farmrpg_etl.scrapers.user import _parse_online, _parse_profile
+from farmrpg_etl.http import ScraperClient
+from farmrpg_etl.models.user import User, UserSnapshot
+from farmrpg_etl.scrapers import user
+from farmrpg_etl.scrapers.user import (
+    FreshnessPolicy,
+    ProfileScrapePool,
+    UserScraper,
+    _parse_online,
+    _parse_profile,
+)
 
 
 @pytest.fixture
@@ -44,3 +55,81 @@ def test_parse_staff(members_staff):
     assert len(staff) == 25
     assert staff[0] == "Atomiccow"
     assert staff[-1] == "wsey54"
+
+
+def _snap(is_ranger: bool = False) -> UserSnapshot:
+    return UserSnapshot(
+        user=User(id=1), ts=datetime.now(), username="test", is_ranger=is_ranger
+    )
+
+
+def test_freshness_policy():
+    policy = FreshnessPolicy(tiers=[(86400, 3600), (0, 600)])
+    assert policy.needs_refresh("test", now=0)
+    policy.record("test", _snap(), now=0)
+    assert not policy.needs_refresh("test", now=300)
+    assert policy.needs_refresh("test", now=600)
+    # Unchanged for a day, so back off to hourly.
+    policy.record("test", None, now=86400)
+    assert not policy.needs_refresh("test", now=86400 + 600)
+    assert policy.needs_refresh("test", now=86400 + 3600)
+    # A change resets it.
+    policy.record("test", _snap(is_ranger=True), now=86400 + 3600)
+    assert policy.needs_refresh("test", now=86400 + 3600 + 600)
+
+
+def test_freshness_policy_staff():
+    policy = FreshnessPolicy(tiers=[(0, 600)])
+    policy.record("test", _snap(), now=0)
+    assert not policy.needs_refresh("test", now=1)
+    policy.staff = {"test"}
+    assert policy.needs_refresh("test", now=1)
+
+
+@pytest.mark.asyncio
+async def test_profile_scrape_pool(monkeypatch):
+    running = 0
+    max_running = 0
+    scraped = []
+
+    async def fake_run(self):
+        nonlocal running, max_running
+        running += 1
+        max_running = max(max_running, running)
+        await asyncio.sleep(0.01)
+        scraped.append(self.username)
+        running -= 1
+
+    monkeypatch.setattr(UserScraper, "run", fake_run)
+    pool = ProfileScrapePool(2)
+    await asyncio.gather(
+        pool.scrape_all(["a", "b", "c", "d"]), pool.scrape_all(["c", "d", "e"])
+    )
+    assert sorted(scraped) == ["a", "b", "c", "d", "e"]
+    assert max_running == 2
+    assert pool.in_flight == {}
+
+
+@pytest.mark.asyncio
+async def test_user_scraper_emit_failed(profile_ryber, monkeypatch):
+    def handler(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(200, content=profile_ryber)
+
+    client = ScraperClient(
+        base_url="https://farmrpg.com/", transport=httpx.MockTransport(handler)
+    )
+    monkeypatch.setattr(user, "client", client)
+    emitted = []
+
+    async def fake_emit(key: str, snap: UserSnapshot) -> None:
+        if not emitted:
+            emitted.append(None)
+            raise asyncio.CancelledError()
+        emitted.append(snap)
+
+    monkeypatch.setattr(user.EVENTS, "emit", fake_emit)
+    with pytest.raises(asyncio.CancelledError):
+        await UserScraper("RybeR").run()
+    # Same page, but it was never handled so it isn't skipped.
+    await UserScraper("RybeR").run()
+    assert emitted[1].username == "RybeR"
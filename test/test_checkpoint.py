@@ -0,0 +1,63 @@
+from datetime import datetime, timezone
+
+import pytest
+
+from farmrpg_etl.checkpoint import Checkpoint
+from farmrpg_etl.models.chat import CompactMessage, Message
+from farmrpg_etl.scrapers.chat import ChatScraper
+from farmrpg_etl.scrapers.mailbox import MailboxScraper
+from farmrpg_etl.utils.cache import FixedSizeCache
+
+
+@pytest.mark.asyncio
+async def test_round_trip(tmp_path):
+    path = tmp_path / "state.pickle"
+    msg = Message(
+        room="help",
+        id="1",
+        ts=datetime(2022, 4, 17, 1, 2, 3, tzinfo=timezone.utc),
+        emblem="def.png",
+        username="coderanger",
+        content="hello",
+    )
+    scraper = ChatScraper(
+        "help", last_messages={"1": CompactMessage.of(msg)}, last_digest=b"digest"
+    )
+    mailbox = MailboxScraper(recent_messages=FixedSizeCache(10))
+    mailbox.recent_messages[5] = True
+    checkpoint = Checkpoint(str(path))
+    scraper.register_checkpoint(checkpoint)
+    mailbox.register_checkpoint(checkpoint)
+    await checkpoint.save()
+
+    restored = ChatScraper("help", last_messages={})
+    restored_mailbox = MailboxScraper(recent_messages=FixedSizeCache(10))
+    checkpoint = Checkpoint(str(path))
+    restored.register_checkpoint(checkpoint)
+    restored_mailbox.register_checkpoint(checkpoint)
+    assert checkpoint.load()
+    assert checkpoint.loaded
+    assert restored.last_messages == {"1": CompactMessage.of(msg)}
+    assert restored.last_digest == b"digest"
+    assert restored_mailbox.recent_messages == {5: True}
+
+
+def test_load_missing(tmp_path):
+    checkpoint = Checkpoint(str(tmp_path / "missing.pickle"))
+    assert not checkpoint.load()
+    assert not checkpoint.loaded
+
+
+def test_load_corrupt(tmp_path):
+    path = tmp_path / "state.pickle"
+    path.write_bytes(b"not a pickle")
+    checkpoint = Checkpoint(str(path))
+    assert not checkpoint.load()
+
+
+@pytest.mark.asyncio
+async def test_disabled():
+    checkpoint = Checkpoint(None)
+    checkpoint.register("test", lambda: 1, lambda state: None)
+    await checkpoint.save()
+    assert not checkpoint.load()
@@ -0,0 +1,176 @@
+import asyncio
+
+import pytest
+
+from farmrpg_etl.events import DROPPED, SPILLED, EventHub
+
+
+@pytest.mark.asyncio
+async def test_emit_prefix():
+    hub = EventHub()
+    seen = []
+
+    @hub.on("chat")
+    async def on_chat(msg):
+        seen.append(("chat", msg))
+
+    @hub.on("chat.help")
+    async def on_help(msg):
+        seen.append(("chat.help", msg))
+
+    assert await hub.emit("chat.help", msg=1)
+    assert await hub.emit("chat.global", msg=2)
+    assert not await hub.emit("flags.help", msg=3)
+    await hub.drain()
+    assert sorted(seen) == [("chat", 1), ("chat", 2), ("chat.help", 1)]
+
+
+@pytest.mark.asyncio
+async def test_error_does_not_stop_worker():
+    hub = EventHub()
+    seen = []
+
+    @hub.on("test", concurrency=1)
+    async def on_test(n):
+        if n == 0:
+            raise ValueError("boom")
+        seen.append(n)
+
+    for n in range(3):
+        await hub.emit("test", n)
+    await hub.drain()
+    assert seen == [1, 2]
+
+
+@pytest.mark.asyncio
+async def test_block():
+    hub = EventHub()
+    gate = asyncio.Event()
+    seen = []
+
+    @hub.on("test", maxsize=2, concurrency=1)
+    async def on_test(n):
+        await gate.wait()
+        seen.append(n)
+
+    for n in range(3):
+        await hub.emit("test", n)
+    # One is being handled and two are queued, so the next emit has to wait.
+    emit = asyncio.create_task(hub.emit("test", 3))
+    await asyncio.sleep(0.01)
+    assert not emit.done()
+    gate.set()
+    await emit
+    await hub.drain()
+    assert seen == [0, 1, 2, 3]
+
+
+@pytest.mark.asyncio
+async def test_drop_oldest():
+    hub = EventHub()
+    gate = asyncio.Event()
+    seen = []
+
+    @hub.on("drop", maxsize=2, policy="drop_oldest", concurrency=1)
+    async def on_test(n):
+        await gate.wait()
+        seen.append(n)
+
+    await hub.emit("drop", 0)
+    # Let the worker pick up the first event.
+    await asyncio.sleep(0)
+    for n in range(1, 5):
+        await hub.emit("drop", n)
+    gate.set()
+    await hub.drain()
+    assert seen == [0, 3, 4]
+    assert DROPPED.get(key="drop", listener=f"{__name__}.{on_test.__qualname__}") == 2
+
+
+@pytest.mark.asyncio
+async def test_spill():
+    hub = EventHub()
+    gate = asyncio.Event()
+    seen = []
+
+    @hub.on("spill", maxsize=2, policy="spill", concurrency=1)
+    async def on_test(n):
+        await gate.wait()
+        seen.append(n)
+
+    await hub.emit("spill", 0)
+    await asyncio.sleep(0)
+    for n in range(1, 10):
+        await hub.emit("spill", n)
+    listener = hub.listeners["spill"][0]
+    assert listener.shards[0].queue.qsize() == 2
+    assert listener.pending == 9
+    gate.set()
+    await hub.drain()
+    assert seen == list(range(10))
+    assert SPILLED.get(key="spill", listener=f"{__name__}.{on_test.__qualname__}") == 7
+
+
+@pytest.mark.asyncio
+async def test_routes_cached():
+    hub = EventHub()
+    seen = []
+
+    async def on_chat(msg):
+        seen.append(msg)
+
+    assert not await hub.emit("chat.help", msg=1)
+    # Unknown prefixes don't get added as empty listener lists, or cached.
+    assert dict(hub.listeners) == {}
+    assert "chat.help" not in hub._routes
+    hub.on("chat", on_chat)
+    assert await hub.emit("chat.help", msg=2)
+    assert "chat.help" in hub._routes
+    await hub.drain()
+    assert seen == [2]
+
+    # Keys can come from user input, so the cache is bounded.
+    for i in range(2000):
+        await hub.emit(f"chat.{i}", msg=i)
+    assert len(hub._routes) <= 1000
+    await hub.drain()
+
+
+@pytest.mark.asyncio
+async def test_partition():
+    hub = EventHub()
+    seen = []
+
+    @hub.on("test", concurrency=4, partition=lambda room, n: room)
+    async def on_test(room, n):
+        # Later events would overtake earlier ones without partitioning.
+        await asyncio.sleep(0.01 / (n + 1))
+        seen.append((room, n))
+
+    for n in range(5):
+        for room in ["a", "b", "c"]:
+            await hub.emit("test", room, n)
+    await hub.drain()
+    for room in ["a", "b", "c"]:
+        assert [n for r, n in seen if r == room] == list(range(5))
+
+
+def test_listener_names():
+    hub = EventHub()
+
+    async def on_chat(msg):
+        pass
+
+    async def other_on_chat(msg):
+        pass
+
+    # Same name, but from another module.
+    other_on_chat.__qualname__ = on_chat.__qualname__
+    other_on_chat.__module__ = "farmrpg_etl.firestore.chat"
+    hub.on("chat", on_chat)
+    hub.on("chat", other_on_chat)
+    names = [listener.name for listener in hub.listeners["chat"]]
+    assert names == [
+        f"{__name__}.{on_chat.__qualname__}",
+        f"farmrpg_etl.firestore.chat.{on_chat.__qualname__}",
+    ]
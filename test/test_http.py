@@ -0,0 +1,88 @@
+import httpx
+import pytest
+
+from farmrpg_etl.http import (
+    TOTAL_TIME,
+    TTFB_TIME,
+    Lane,
+    ScraperClient,
+    lane,
+)
+
+
+@pytest.mark.asyncio
+async def test_request_timing():
+    def handler(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(200, content=b"hello")
+
+    client = ScraperClient(
+        base_url="https://farmrpg.com/", transport=httpx.MockTransport(handler)
+    )
+    with lane(Lane.CHAT):
+        resp = await client.get("timing-test.php")
+    assert resp.content == b"hello"
+    for hist in [TTFB_TIME, TOTAL_TIME]:
+        value = hist.get(endpoint="timing-test.php", lane="chat")
+        assert value is not None
+        assert value.count == 1
+
+
+@pytest.mark.asyncio
+async def test_get_cached_etag():
+    requests = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        if request.headers.get("If-None-Match") == '"v1"':
+            return httpx.Response(304)
+        return httpx.Response(200, headers={"ETag": '"v1"'}, content=b"hello")
+
+    client = ScraperClient(
+        base_url="https://farmrpg.com/", transport=httpx.MockTransport(handler)
+    )
+    resp, changed = await client.get_cached("etag.php")
+    assert changed is True
+    assert resp.content == b"hello"
+    resp, changed = await client.get_cached("etag.php")
+    assert changed is False
+    assert resp.status_code == 200
+    assert resp.content == b"hello"
+    assert len(requests) == 2
+    assert requests[1].headers["If-None-Match"] == '"v1"'
+
+
+@pytest.mark.asyncio
+async def test_get_cached_hash():
+    bodies = [b"one", b"one", b"two"]
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        assert "If-None-Match" not in request.headers
+        return httpx.Response(200, content=bodies.pop(0))
+
+    client = ScraperClient(
+        base_url="https://farmrpg.com/", transport=httpx.MockTransport(handler)
+    )
+    assert (await client.get_cached("hash.php"))[1] is True
+    assert (await client.get_cached("hash.php"))[1] is False
+    assert (await client.get_cached("hash.php"))[1] is True
+    client.invalidate("hash.php")
+    bodies.append(b"two")
+    assert (await client.get_cached("hash.php"))[1] is True
+
+
+@pytest.mark.asyncio
+async def test_get_cached_ttl():
+    requests = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        return httpx.Response(200, content=b"hello")
+
+    client = ScraperClient(
+        base_url="https://farmrpg.com/", transport=httpx.MockTransport(handler)
+    )
+    await client.get_cached("ttl.php", params={"a": "1"}, ttl=60)
+    resp, changed = await client.get_cached("ttl.php", params={"a": "1"}, ttl=60)
+    assert changed is False
+    assert resp.content == b"hello"
+    assert len(requests) == 1
@@ -0,0 +1,26 @@
+from farmrpg_etl.metrics import MetricsRegistry
+
+
+def test_render():
+    registry = MetricsRegistry()
+    registry.counter("requests_total", "Requests.").inc(2, path='/a"b')
+    registry.gauge("depth", "Queue depth.").set(3)
+    hist = registry.histogram("latency_seconds", "Latency.", buckets=(0.1, 1))
+    hist.observe(0.05)
+    hist.observe(0.5)
+    hist.observe(5)
+    assert registry.render().splitlines() == [
+        "# HELP requests_total Requests.",
+        "# TYPE requests_total counter",
+        'requests_total{path="/a\\"b"} 2',
+        "# HELP depth Queue depth.",
+        "# TYPE depth gauge",
+        "depth 3",
+        "# HELP latency_seconds Latency.",
+        "# TYPE latency_seconds histogram",
+        'latency_seconds_bucket{le="0.1"} 1',
+        'latency_seconds_bucket{le="1"} 2',
+        'latency_seconds_bucket{le="+Inf"} 3',
+        "latency_seconds_sum 5.55",
+        "latency_seconds_count 3",
+    ]
@@ -0,0 +1,144 @@
+import asyncio
+import time
+
+import pytest
+
+from farmrpg_etl.tasks import (
+    LOOP_LAG,
+    TASK_OVERRUNS,
+    TASK_TIME,
+    TASK_TIMEOUTS,
+    AdaptiveInterval,
+    create_lag_monitor,
+    create_periodic_task,
+)
+
+
+def test_adaptive_interval_busy():
+    interval = AdaptiveInterval(1, 10, jitter=0)
+    assert interval.update(5, 1) == 1
+
+
+def test_adaptive_interval_backs_off():
+    interval = AdaptiveInterval(1, 10, jitter=0)
+    delays = [interval.update(2, 1)]
+    for _ in range(10):
+        delays.append(interval.update(0, delays[-1]))
+    assert delays[0] == 1
+    assert delays == sorted(delays)
+    assert delays[-1] == 10
+
+
+def test_adaptive_interval_quiet():
+    interval = AdaptiveInterval(1, 10, jitter=0)
+    assert interval.update(0) == 10
+    # Activity comes back, tighten up again.
+    assert interval.update(100, 10) == 1
+
+
+def test_adaptive_interval_jitter():
+    interval = AdaptiveInterval(1, 10, jitter=0.5)
+    delays = {interval.update(0) for _ in range(20)}
+    assert len(delays) > 1
+    assert all(5 <= d <= 15 for d in delays)
+
+
+@pytest.mark.asyncio
+async def test_periodic_task_adaptive():
+    runs = []
+
+    async def coro():
+        runs.append(True)
+        return 1
+
+    task = create_periodic_task(coro, AdaptiveInterval(0.01, 1, jitter=0))
+    await asyncio.sleep(0.1)
+    task.stop()
+    assert len(runs) > 2
+
+
+@pytest.mark.asyncio
+async def test_periodic_task_metrics():
+    async def slow():
+        await asyncio.sleep(0.02)
+
+    task = create_periodic_task(slow, 0.01, name="test-metrics")
+    await asyncio.sleep(0.05)
+    task.stop()
+    hist = TASK_TIME.get(task="test-metrics")
+    assert hist is not None and hist.count >= 1
+    assert TASK_OVERRUNS.get(task="test-metrics") == hist.count
+
+
+@pytest.mark.asyncio
+async def test_lag_monitor():
+    before = LOOP_LAG.get()
+    count = before.count if before else 0
+    task = create_lag_monitor(0.01)
+    await asyncio.sleep(0.01)
+    # Block the loop so the monitor wakes up late.
+    time.sleep(0.05)
+    await asyncio.sleep(0.01)
+    task.cancel()
+    hist = LOOP_LAG.get()
+    assert hist is not None and hist.count > count
+    assert hist.sum >= 0.03
+
+
+async def _run_ticks(duration: float, **kwargs) -> list[float]:
+    loop = asyncio.get_running_loop()
+    starts = []
+
+    async def coro():
+        starts.append(loop.time())
+        # Only the first run is slow.
+        if len(starts) == 1:
+            await asyncio.sleep(duration)
+
+    task = create_periodic_task(coro, 0.05, fixed_rate=True, **kwargs)
+    await asyncio.sleep(0.29)
+    task.stop()
+    return [start - starts[0] for start in starts]
+
+
+@pytest.mark.asyncio
+async def test_fixed_rate():
+    starts = await _run_ticks(0)
+    # Ticks stay on the 50ms grid rather than drifting.
+    assert len(starts) == 6
+    for i, start in enumerate(starts):
+        assert start == pytest.approx(i * 0.05, abs=0.01)
+
+
+@pytest.mark.asyncio
+async def test_fixed_rate_skip():
+    starts = await _run_ticks(0.12, overrun="skip")
+    assert starts == pytest.approx([0, 0.15, 0.2, 0.25], abs=0.015)
+
+
+@pytest.mark.asyncio
+async def test_fixed_rate_immediate():
+    starts = await _run_ticks(0.12, overrun="immediate")
+    # Missed ticks at 0.05 and 0.1 are run back to back.
+    assert starts == pytest.approx([0, 0.12, 0.12, 0.15, 0.2, 0.25], abs=0.015)
+
+
+@pytest.mark.asyncio
+async def test_fixed_rate_coalesce():
+    starts = await _run_ticks(0.12, overrun="coalesce")
+    assert starts == pytest.approx([0, 0.12, 0.17, 0.22, 0.27], abs=0.015)
+
+
+@pytest.mark.asyncio
+async def test_timeout():
+    runs = []
+
+    async def hang():
+        runs.append(True)
+        await asyncio.sleep(10)
+
+    task = create_periodic_task(hang, 0, name="test-timeout", timeout=0.01)
+    await asyncio.sleep(0.05)
+    task.stop()
+    assert len(runs) > 1
+    assert TASK_TIMEOUTS.get(task="test-timeout") >= 1
@@ -0,0 +1,75 @@
+import asyncio
+
+import pytest
+
+from farmrpg_etl.utils.batch import BatchWriter
+
+
+@pytest.mark.asyncio
+async def test_batch_by_delay():
+    batches = []
+
+    async def write(items: list[int]) -> None:
+        batches.append(items)
+
+    writer = BatchWriter("test-delay", write, max_delay=0.01)
+    for i in range(5):
+        await writer.add(i)
+    assert batches == []
+    await asyncio.sleep(0.05)
+    assert batches == [[0, 1, 2, 3, 4]]
+
+
+@pytest.mark.asyncio
+async def test_batch_by_size():
+    batches = []
+
+    async def write(items: list[int]) -> None:
+        batches.append(items)
+
+    writer = BatchWriter("test-size", write, max_size=3, max_delay=10)
+    for i in range(7):
+        await writer.add(i)
+    # Doesn't wait for max_delay once a batch is full.
+    await asyncio.sleep(0.01)
+    assert batches == [[0, 1, 2], [3, 4, 5], [6]]
+
+
+@pytest.mark.asyncio
+async def test_backpressure():
+    batches = []
+    release = asyncio.Event()
+
+    async def write(items: list[int]) -> None:
+        await release.wait()
+        batches.append(items)
+
+    writer = BatchWriter("test-backpressure", write, max_size=2, max_pending=2)
+    await writer.add(0)
+    await writer.add(1)
+    # The first batch is being written, fill up pending again.
+    await asyncio.sleep(0.01)
+    await writer.add(2)
+    await writer.add(3)
+    blocked = asyncio.create_task(writer.add(4))
+    await asyncio.sleep(0.01)
+    assert not blocked.done()
+    release.set()
+    await blocked
+    await writer.flush()
+    assert batches == [[0, 1], [2, 3], [4]]
+
+
+@pytest.mark.asyncio
+async def test_retry():
+    attempts = []
+
+    async def write(items: list[int]) -> None:
+        attempts.append(items)
+        if len(attempts) < 3:
+            raise ValueError("nope")
+
+    writer = BatchWriter("test-retry", write, max_retries=2, retry_delay=0.001)
+    await writer.add(1)
+    await writer.flush()
+    assert attempts == [[1], [1], [1]]
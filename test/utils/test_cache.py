@@ -0,0 +1,112 @@
+import copy
+import pickle
+
+import pytest
+
+from farmrpg_etl.utils import cache as cache_mod
+from farmrpg_etl.utils.cache import FixedSizeCache
+
+
+def test_fifo():
+    cache = FixedSizeCache[str, int](2)
+    cache["a"] = 1
+    cache["b"] = 2
+    assert cache["a"] == 1
+    cache["c"] = 3
+    assert list(cache) == ["b", "c"]
+    assert cache.evictions == 1
+
+
+def test_lru():
+    cache = FixedSizeCache[str, int](2, policy="lru")
+    cache["a"] = 1
+    cache["b"] = 2
+    assert cache["a"] == 1
+    cache["c"] = 3
+    assert list(cache) == ["a", "c"]
+    # Overwriting also counts as a use.
+    cache["a"] = 4
+    cache["d"] = 5
+    assert list(cache) == ["a", "d"]
+
+
+def test_ttl(monkeypatch: pytest.MonkeyPatch):
+    now = 100.0
+    monkeypatch.setattr(cache_mod.time, "monotonic", lambda: now)
+    cache = FixedSizeCache[str, int](10, ttl=5)
+    cache["a"] = 1
+    now = 104.0
+    assert "a" in cache
+    now = 105.0
+    assert "a" not in cache
+    assert cache.get("a") is None
+    assert len(cache) == 0
+    assert cache.evictions == 1
+    cache["b"] = 2
+    now = 110.0
+    assert cache.pop("b", None) is None
+    with pytest.raises(KeyError):
+        cache.pop("b")
+
+
+def test_max_bytes():
+    cache = FixedSizeCache[str, bytes](max_bytes=10, sizeof=len)
+    cache["a"] = b"12345"
+    cache["b"] = b"1234"
+    assert cache.bytes == 9
+    cache["a"] = b"123"
+    assert cache.bytes == 7
+    cache["c"] = b"123456"
+    assert list(cache) == ["b", "c"]
+    assert cache.bytes == 10
+    del cache["b"]
+    assert cache.bytes == 6
+
+
+def test_stats(monkeypatch: pytest.MonkeyPatch):
+    # Keep the test's counts out of the global registry.
+    monkeypatch.setattr(cache_mod.CACHE_REQUESTS, "values", {})
+    cache = FixedSizeCache[str, int](10, name="test_cache_stats")
+    cache["a"] = 1
+    assert cache.get("a") == 1
+    assert cache.get("b") is None
+    with pytest.raises(KeyError):
+        cache["b"]
+    assert (cache.hits, cache.misses) == (1, 2)
+    assert cache_mod.CACHE_REQUESTS.get(cache="test_cache_stats", result="miss") == 2
+
+
+def test_pop():
+    cache = FixedSizeCache[str, int](10, max_bytes=100, sizeof=lambda v: v)
+    cache["a"] = 7
+    assert cache.pop("a") == 7
+    assert cache.pop("a", None) is None
+    with pytest.raises(KeyError):
+        cache.pop("a")
+    assert cache.bytes == 0
+    assert cache.setdefault("b", 3) == 3
+    assert cache.setdefault("b", 4) == 3
+
+
+def test_plain_fifo():
+    cache = FixedSizeCache[str, int](2)
+    cache["a"] = 1
+    cache["b"] = 2
+    cache["c"] = 3
+    assert cache.get("a") is None
+    assert cache["b"] == 2
+    assert list(cache) == ["b", "c"]
+    assert isinstance(cache, FixedSizeCache)
+
+
+@pytest.mark.parametrize("policy", ["fifo", "lru"])
+def test_copy(policy):
+    cache = FixedSizeCache[str, int](2, policy=policy)
+    cache["a"] = 1
+    for restored in [copy.copy(cache), pickle.loads(pickle.dumps(cache))]:
+        restored["b"] = 2
+        restored["c"] = 3
+        assert list(restored) == ["b", "c"]
+        assert restored.get("b") == 2
+        assert type(restored) is type(cache)
+    assert list(cache) == ["a"]
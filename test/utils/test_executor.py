@@ -0,0 +1,31 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import pytest
+
+from farmrpg_etl.utils import executor
+
+
+@pytest.mark.asyncio
+async def test_inline(monkeypatch):
+    monkeypatch.setattr(executor, "executor", None)
+    assert await executor.run(sum, [1, 2, 3]) == 6
+    assert await executor.run_list(range, 3) == [0, 1, 2]
+
+
+@pytest.mark.asyncio
+async def test_thread(monkeypatch):
+    pool = ThreadPoolExecutor(2)
+    monkeypatch.setattr(executor, "executor", pool)
+    assert await executor.run(sum, [1, 2, 3]) == 6
+    assert await executor.run_list(range, 3) == [0, 1, 2]
+    pool.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_process(monkeypatch):
+    pool = ProcessPoolExecutor(1, mp_context=multiprocessing.get_context("spawn"))
+    monkeypatch.setattr(executor, "executor", pool)
+    assert await executor.run(sum, [1, 2, 3]) == 6
+    assert await executor.run_list(range, 3) == [0, 1, 2]
+    pool.shutdown()
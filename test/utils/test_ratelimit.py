@@ -0,0 +1,66 @@
+import asyncio
+import time
+
+import pytest
+
+from farmrpg_etl.utils.ratelimit import PriorityRateLimiter
+
+
+@pytest.mark.asyncio
+async def test_rate_limit():
+    limiter = PriorityRateLimiter(rate=50, burst=1, concurrency=10)
+    start = time.monotonic()
+    for _ in range(6):
+        async with limiter.limit():
+            pass
+    # First one is free from the burst, the rest wait 20ms each.
+    assert time.monotonic() - start >= 0.09
+
+
+@pytest.mark.asyncio
+async def test_priority_order():
+    limiter = PriorityRateLimiter(rate=100, burst=1, concurrency=10)
+    order = []
+
+    async def worker(priority: int, name: str):
+        async with limiter.limit(priority):
+            order.append(name)
+
+    # Use up the burst so everything else has to queue.
+    await limiter.acquire()
+    await limiter.release()
+    await asyncio.gather(
+        worker(3, "low1"), worker(3, "low2"), worker(0, "high"), worker(1, "mid")
+    )
+    assert order == ["high", "mid", "low1", "low2"]
+
+
+@pytest.mark.asyncio
+async def test_concurrency():
+    limiter = PriorityRateLimiter(rate=1000, burst=100, concurrency=2)
+    running = []
+    peak = []
+
+    async def worker():
+        async with limiter.limit():
+            running.append(True)
+            peak.append(len(running))
+            await asyncio.sleep(0.01)
+            running.pop()
+
+    await asyncio.gather(*(worker() for _ in range(6)))
+    assert max(peak) == 2
+    assert limiter.in_flight == 0
+
+
+@pytest.mark.asyncio
+async def test_cancelled_waiter():
+    limiter = PriorityRateLimiter(rate=10, burst=1, concurrency=10)
+    await limiter.acquire()
+    waiter = asyncio.create_task(limiter.acquire())
+    await asyncio.sleep(0.01)
+    assert limiter.waiting == 1
+    waiter.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await waiter
+    assert limiter.waiting == 0